@@ -0,0 +1,26 @@
+import os
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# 优先读取 EXPORT_DIR 下由 `python export.py <dataset> <file>` 导出的文件，否则从接口拉取 Arrow 流
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:8000")
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "")
+
+
+def load_table(dataset, **params) -> pa.Table:
+    """读取导出的数据集为 Arrow Table，需要 DataFrame 时再调用 .to_pandas()"""
+    if EXPORT_DIR:
+        path = os.path.join(EXPORT_DIR, dataset)
+        if os.path.exists(path + ".parquet"):
+            return pq.read_table(path + ".parquet")
+        if os.path.exists(path + ".arrow"):
+            with pa.OSFile(path + ".arrow", "rb") as f:
+                return pa.ipc.open_stream(f).read_all()
+
+    params = {key: value for key, value in params.items() if value is not None}
+    # 使用标准库：边下载边解析 Arrow 流，HTTP 错误抛出 HTTPError
+    with urlopen(f"{BASE_URL}/export/{dataset}?{urlencode({'format': 'arrow', **params})}") as response:
+        return pa.ipc.open_stream(response).read_all()
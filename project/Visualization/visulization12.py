@@ -1,12 +1,16 @@
-import json
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-with open("D:/homework/data/期末/response.json", 'r', encoding='utf-8') as file:
-    data = json.load(file)
+from export_loader import load_table
 
-avg_freq = pd.DataFrame(data['average_daily_frequency'].items(), columns=['Device', 'Frequency'])
+# 每行是 (设备, 用户, 开始小时, 结束小时) 上的使用次数
+rollups = load_table("device_usage_hourly").to_pandas()
+rollups['Device'] = rollups['device_name'].fillna('Unknown')
+rollups['Day'] = rollups['hour'].dt.date
+
+daily = rollups.groupby(['Device', 'Day'])['session_count'].sum()
+daily = daily[daily > 0]
+avg_freq = daily.groupby(level='Device').mean().round(2).reset_index(name='Frequency')
 avg_freq = avg_freq.sort_values('Frequency', ascending=False)
 
 plt.figure(figsize=(12, 6))
@@ -15,16 +19,14 @@ plt.title('Average Daily Usage Frequency by Device')
 plt.tight_layout()
 plt.show()
 
-hourly_data = []
-for device, hours in data['hourly_distribution'].items():
-    for hour, count in hours.items():
-        hourly_data.append({'Device': device, 'Hour': int(hour), 'Count': count})
-        
-hourly_df = pd.DataFrame(hourly_data)
+# 一次使用计入开始到结束之间的每个小时（未结束的记录 end_hour 为 -1，不计入）
+rollups['Hour'] = [list(range(h.hour, e + 1)) for h, e in zip(rollups['hour'], rollups['end_hour'])]
+hourly_df = rollups.explode('Hour').dropna(subset=['Hour'])
+hourly_df = hourly_df.groupby(['Device', 'Hour'])['session_count'].sum().reset_index(name='Count')
 heatmap_data = hourly_df.pivot_table(index='Device', columns='Hour', values='Count', fill_value=0)
 
 plt.figure(figsize=(16, 10))
 sns.heatmap(heatmap_data, cmap='YlOrRd', linewidths=0.5)
 plt.title('Hourly Usage Distribution by Device')
 plt.tight_layout()
-plt.show()
\ No newline at end of file
+plt.show()
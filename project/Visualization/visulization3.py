@@ -1,14 +1,16 @@
-import requests
 import matplotlib.pyplot as plt
 import seaborn as sns
-import pandas as pd
 
-response = requests.get("http://localhost:8000/analysis/area-vs-usage")
-data = response.json()
+from export_loader import load_table
 
-df = pd.DataFrame(data["raw_data"])
-outlier_ids = {u['user_id'] for u in data.get("outliers", [])}
-df["is_outlier"] = df["user_id"].apply(lambda x: x in outlier_ids)
+df = load_table("area_usage").to_pandas()
+
+# 与 /analysis/area-vs-usage 相同的异常规则：大房（>120）低使用 / 小房（<=80）高使用
+usage_mean = df["usage_count"].mean()
+usage_std = df["usage_count"].std(ddof=0)
+large_low = (df["house_area"] > 120) & (df["usage_count"] < usage_mean - 1.2 * usage_std)
+small_high = (df["house_area"] <= 80) & (df["usage_count"] > usage_mean + 1.2 * usage_std)
+df["is_outlier"] = large_low | small_high
 
 plt.figure(figsize=(10, 6))
 plt.title("Relationship Between House Area And Equipment Use Frequency", fontsize=16)
@@ -1,20 +1,20 @@
-import requests
 import matplotlib.pyplot as plt
-import pandas as pd
 import io
 import sys
 
+from export_loader import load_table
+
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf8')
 
-BASE_URL = "http://localhost:8000"
-response = requests.get(f"{BASE_URL}/auto-alarm-check")
-data = response.json()
+# 告警由 /auto-alarm-check 或写入时的即时检查记录，这里只读取关联了使用记录的安防事件
+df = load_table("security_events").select(["usage_log_id", "device_type"]).to_pandas()
+df = df[df['usage_log_id'].notna()]
 
-if not data:
+if df.empty:
     print("no abnormal events were detected")
     exit()
 
-df = pd.DataFrame(data)
+df['device_type'] = df['device_type'].fillna('Unknown')
 
 plt.style.use('ggplot')
 fig, ax = plt.subplots(figsize=(8, 6))
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+# 告警规则配置，格式见 alarm_rules.json：
+#   default:                 全局的异常时段 hours（[起, 止] 闭区间小时列表）与时长阈值 duration_seconds
+#   suspicious_device_types: 可疑设备类型
+#   device_types:            按设备类型覆盖 hours / duration_seconds / suspicious
+#   users:                   按用户 id 覆盖 hours / duration_seconds（优先级最高）
+RULES_PATH = os.environ.get("ALARM_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "alarm_rules.json"))
+
+ABNORMAL_HOUR = 1
+SUSPICIOUS_TYPE = 2
+LONG_USAGE = 4
+REASONS = ((ABNORMAL_HOUR, "异常时段使用"), (SUSPICIOUS_TYPE, "可疑设备类型"), (LONG_USAGE, "长时间使用"))
+
+
+def hour_mask(windows) -> int:
+    """把 [[0, 4], [22, 23]] 这样的小时区间编译为 24 位掩码"""
+    mask = 0
+    for start, end in windows:
+        for hour in range(start, end + 1):
+            mask |= 1 << (hour % 24)
+    return mask
+
+
+def reasons_for(mask: int) -> List[str]:
+    return [text for bit, text in REASONS if mask & bit]
+
+
+def severity_for(mask: int) -> str:
+    return "warning" if bin(mask).count("1") < 2 else "critical"
+
+
+class CompiledRules:
+    """规则编译后的查找表：设备类型编码 -> 小时掩码 / 时长阈值 / 是否可疑，用户 id -> 覆盖项"""
+
+    def __init__(self, config: dict):
+        import numpy as np
+
+        default = config.get("default", {})
+        default_mask = hour_mask(default.get("hours", []))
+        default_duration = float(default.get("duration_seconds", float("inf")))
+        suspicious = set(config.get("suspicious_device_types", []))
+        device_types = config.get("device_types", {})
+
+        # 编码 0 留给未配置的设备类型
+        names = sorted(suspicious | set(device_types))
+        self.type_codes: Dict[Optional[str], int] = {name: code for code, name in enumerate(names, start=1)}
+        self.type_hour_mask = np.full(len(names) + 1, default_mask, dtype=np.int64)
+        self.type_duration = np.full(len(names) + 1, default_duration, dtype=np.float64)
+        self.type_suspicious = np.zeros(len(names) + 1, dtype=bool)
+        for name, code in self.type_codes.items():
+            override = device_types.get(name, {})
+            if "hours" in override:
+                self.type_hour_mask[code] = hour_mask(override["hours"])
+            if "duration_seconds" in override:
+                self.type_duration[code] = float(override["duration_seconds"])
+            self.type_suspicious[code] = override.get("suspicious", name in suspicious)
+
+        users = sorted((int(uid), override) for uid, override in config.get("users", {}).items())
+        self.user_ids = np.array([uid for uid, _ in users], dtype=np.int64)
+        self.user_hour_mask = np.array([hour_mask(o.get("hours", [])) for _, o in users], dtype=np.int64)
+        self.user_has_hours = np.array(["hours" in o for _, o in users], dtype=bool)
+        self.user_duration = np.array([float(o.get("duration_seconds", 0)) for _, o in users], dtype=np.float64)
+        self.user_has_duration = np.array(["duration_seconds" in o for _, o in users], dtype=bool)
+
+    def encode_types(self, device_types) -> "np.ndarray":
+        import numpy as np
+
+        codes = self.type_codes
+        return np.fromiter((codes.get(t, 0) for t in device_types), dtype=np.int64, count=len(device_types))
+
+    def evaluate(self, user_ids, device_types, starts, finishes) -> "np.ndarray":
+        """按列批量执行规则，返回每条记录的原因位掩码（0 表示未命中）
+
+        starts / finishes 为 datetime64 数组（或可转换的 datetime 列表）。
+        """
+        import numpy as np
+
+        starts = np.asarray(starts, dtype="datetime64[us]")
+        finishes = np.asarray(finishes, dtype="datetime64[us]")
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        codes = self.encode_types(device_types)
+
+        hours = ((starts - starts.astype("datetime64[D]")) // np.timedelta64(1, "h")).astype(np.int64)
+        durations = (finishes - starts) / np.timedelta64(1, "s")
+
+        masks = self.type_hour_mask[codes]
+        limits = self.type_duration[codes]
+        if len(self.user_ids):
+            index = np.minimum(np.searchsorted(self.user_ids, user_ids), len(self.user_ids) - 1)
+            hit = self.user_ids[index] == user_ids
+            masks = np.where(hit & self.user_has_hours[index], self.user_hour_mask[index], masks)
+            limits = np.where(hit & self.user_has_duration[index], self.user_duration[index], limits)
+
+        result = ((masks >> hours) & 1) * ABNORMAL_HOUR
+        result |= self.type_suspicious[codes] * SUSPICIOUS_TYPE
+        result |= (durations > limits) * LONG_USAGE
+        return result
+
+    def summarize(self, masks) -> dict:
+        """只统计数量，不构造告警文本"""
+        import numpy as np
+
+        masks = np.asarray(masks, dtype=np.int64)
+        flagged = masks[masks > 0]
+        bits = sum(((flagged & bit) > 0).astype(np.int64) for bit, _ in REASONS)
+        return {
+            "total_logs": int(len(masks)),
+            "flagged_logs": int(len(flagged)),
+            "by_reason": {text: int(np.count_nonzero(flagged & bit)) for bit, text in REASONS},
+            "by_severity": {
+                "warning": int(np.count_nonzero(bits == 1)),
+                "critical": int(np.count_nonzero(bits >= 2)),
+            },
+        }
+
+
+def load(path: str = RULES_PATH) -> CompiledRules:
+    with open(path, encoding="utf-8") as f:
+        return CompiledRules(json.load(f))
+
+
+_rules: Optional[CompiledRules] = None
+_lock = threading.Lock()
+
+
+def get_rules() -> CompiledRules:
+    """首次使用时加载并编译规则"""
+    global _rules
+    if _rules is None:
+        with _lock:
+            if _rules is None:
+                _rules = load()
+    return _rules
+
+
+def reload(path: str = RULES_PATH) -> CompiledRules:
+    global _rules
+    rules = load(path)
+    with _lock:
+        _rules = rules
+    return rules
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, exists, func, insert, select
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+
+import models, schemas, alarm_rules, refdata
+
+# 写入使用记录时即时执行告警规则（INLINE_ALARMS=0 关闭，仅保留 /auto-alarm-check 批量检查）
+INLINE_ALARMS = os.environ.get("INLINE_ALARMS", "1").lower() in ("1", "true", "yes", "on")
+# 每个订阅者的待推送队列上限，满了丢弃最旧的告警
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("ALERT_QUEUE_SIZE", "100"))
+# /auto-alarm-check 的 id 高水位只作为下界：id 较小但提交较晚的记录（长事务、预取 id 的合并写入）
+# 在回看范围内仍会被检查，是否已告警以 security_events 中的关联为准
+CHECK_ID_MARGIN = int(os.environ.get("ALARM_CHECK_ID_MARGIN", "10000"))
+
+
+class AlarmInput(NamedTuple):
+    id: int
+    user_id: int
+    start_time: datetime
+    finish_time: datetime
+    user_name: Optional[str]
+    device_name: Optional[str]
+    device_type: Optional[str]
+
+
+# ------------------ 规则 ------------------ #
+def flag(logs: Iterable[AlarmInput]) -> List[Tuple[AlarmInput, models.SecurityEvent, List[str]]]:
+    """按列批量执行编译后的规则，只为命中的记录构造（尚未写入的）SecurityEvent"""
+    logs = list(logs)
+    if not logs:
+        return []
+    masks = alarm_rules.get_rules().evaluate(
+        [log.user_id for log in logs],
+        [log.device_type for log in logs],
+        [log.start_time for log in logs],
+        [log.finish_time for log in logs],
+    )
+
+    flagged = []
+    for log, mask in zip(logs, masks.tolist()):
+        if mask:
+            reasons = alarm_rules.reasons_for(mask)
+            message = f"⚠️ 检测到异常: {' & '.join(reasons)} - 设备: {log.device_name} (用户: {log.user_name})"
+            event = models.SecurityEvent(
+                user_id=log.user_id,
+                usage_log_id=log.id,
+                event=message,
+                severity=alarm_rules.severity_for(mask),
+                timestamp=datetime.utcnow()
+            )
+            flagged.append((log, event, reasons))
+    return flagged
+
+
+def details(log: AlarmInput, event: models.SecurityEvent, reasons: List[str]) -> schemas.SecurityEventWithDetails:
+    return schemas.SecurityEventWithDetails(
+        id=event.id,
+        user_id=log.user_id,
+        event=event.event,
+        severity=event.severity,
+        timestamp=event.timestamp,
+        user_name=log.user_name or "Unknown",
+        device_name=log.device_name or "Unknown",
+        device_type=log.device_type or "Unknown",
+        start_time=log.start_time,
+        duration_minutes=round((log.finish_time - log.start_time).total_seconds() / 60, 1),
+        reasons=reasons
+    )
+
+
+def check_new_logs(db: Session, logs: List[Tuple[int, int, int, datetime, datetime]]):
+    """即时检查刚写入的记录 (id, user_id, device_id, start, finish)，命中的事件加入当前事务"""
+    if not INLINE_ALARMS or not logs:
+        return []
+    ref = refdata.get(db, {log[1] for log in logs}, {log[2] for log in logs})
+    inputs = [
+        AlarmInput(log_id, user_id, start, finish, ref.user_names.get(user_id),
+                   ref.device_names.get(device_id), ref.device_types.get(device_id))
+        for log_id, user_id, device_id, start, finish in logs
+    ]
+    flagged = flag(inputs)
+    db.add_all([event for _, event, _ in flagged])
+    return flagged
+
+
+# ------------------ 批量检查的高水位 ------------------ #
+def lock_checkpoint(db: Session, name: str) -> models.AlarmCheckpoint:
+    """确保检查点存在并加行锁；并发的首次调用不会重复插入（ON CONFLICT DO NOTHING）"""
+    table = models.AlarmCheckpoint.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        db.execute(
+            insert(table)
+            .values(name=name, last_log_id=0, updated_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=[table.c.name])
+        )
+    elif db.get(models.AlarmCheckpoint, name) is None:
+        db.add(models.AlarmCheckpoint(name=name, last_log_id=0))
+        db.flush()
+    return db.scalars(
+        select(models.AlarmCheckpoint).where(models.AlarmCheckpoint.name == name).with_for_update()
+    ).one()
+
+
+def suppress_statement(clauses: list):
+    """INSERT ... SELECT：把即将删除的事件（clauses 选中）所关联、仍在回看范围内的使用记录加入 suppressed_alarms"""
+    security_event, suppressed = models.SecurityEvent, models.SuppressedAlarm
+    watermark = select(func.coalesce(func.max(models.AlarmCheckpoint.last_log_id), 0)).scalar_subquery()
+    return insert(suppressed).from_select(
+        ["usage_log_id"],
+        select(security_event.usage_log_id).where(
+            *clauses,
+            security_event.usage_log_id > watermark - CHECK_ID_MARGIN,
+            ~exists().where(suppressed.usage_log_id == security_event.usage_log_id),
+        ).distinct(),
+    )
+
+
+def prune_suppressed(db: Session, last_log_id: int):
+    """高水位推进后，回看范围以外的抑制记录不再需要"""
+    db.execute(delete(models.SuppressedAlarm).where(models.SuppressedAlarm.usage_log_id <= last_log_id - CHECK_ID_MARGIN))
+
+
+# 单条删除（同步与异步 CRUD 接口）经过 ORM；批量删除由 bulk 直接执行 suppress_statement
+@sa_event.listens_for(models.SecurityEvent, "before_delete")
+def _orm_deleting(mapper, connection, target):
+    if target.usage_log_id is not None:
+        connection.execute(suppress_statement([models.SecurityEvent.id == target.id]))
+
+
+# ------------------ 推送 ------------------ #
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, payload: dict):
+        # 在订阅者所在的事件循环中执行；慢客户端只丢弃自己最旧的告警，不阻塞写入方
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(payload)
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class AlertBroker:
+    """进程内的告警广播，供 SSE / WebSocket 订阅"""
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, payload: dict):
+        """可在任意线程调用"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, payload)
+            except RuntimeError:  # 事件循环已关闭
+                self.unsubscribe(subscriber)
+
+
+broker = AlertBroker()
+
+
+def publish(flagged):
+    """事务提交后推送新告警"""
+    for log, event, reasons in flagged:
+        broker.publish(details(log, event, reasons).model_dump(mode="json"))
@@ -0,0 +1,499 @@
+import multiprocessing
+import os
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, cast, extract, func, literal, select, union_all
+from sqlalchemy.orm import Session
+
+import models, cousage
+# 统计逻辑在 cousage 中，工作进程只导入该模块
+from cousage import Interval
+
+# 设备同时使用统计的常驻进程池大小；请求的 workers 决定分批数，同时运行的进程不超过该值
+COUSAGE_POOL_WORKERS = int(os.environ.get("COUSAGE_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+
+# ------------------ 设备同时使用 ------------------ #
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _cousage_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 与图表渲染相同：不在多线程的服务进程中直接 fork，工作进程从 forkserver（或 spawn）启动
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(COUSAGE_POOL_WORKERS, mp_context=context)
+        return _pool
+
+
+def count_cousage_pairs(user_logs: Iterable[List[Interval]], workers: int = 0) -> Counter:
+    """对每个用户的记录统计设备对；workers > 1 时按用户分成 workers 批交给常驻进程池"""
+    global _pool
+    user_logs = list(user_logs)
+    if workers <= 1 or len(user_logs) < 2:
+        return cousage.cousage_pairs_batch(user_logs)
+
+    batches = [user_logs[i::workers] for i in range(workers)]
+    pairs = Counter()
+    pool = _cousage_pool()
+    try:
+        for partial in pool.map(cousage.cousage_pairs_batch, batches):
+            pairs.update(partial)
+    except BrokenProcessPool:
+        # 工作进程异常退出后丢弃进程池，下一次请求重新创建
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+    return pairs
+
+
+def build_cousage_matrix(pairs: Counter, device_map: Dict[int, str]) -> Dict[str, Dict[str, int]]:
+    """把设备 id 对的计数按设备名汇总成对称矩阵"""
+    co_usage = defaultdict(lambda: defaultdict(int))
+    for (d1, d2), count in pairs.items():
+        name1 = device_map.get(d1, f"Device {d1}")
+        name2 = device_map.get(d2, f"Device {d2}")
+        if name1 != name2:
+            co_usage[name1][name2] += count
+            co_usage[name2][name1] += count
+    return {k: dict(v) for k, v in co_usage.items()}
+
+
+# ------------------ 设备使用频率及时间段 ------------------ #
+def usage_log_filters(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      device_id: Optional[int] = None) -> list:
+    """按开始时间窗口 [start, end) 与设备过滤使用记录"""
+    clauses = []
+    if start is not None:
+        clauses.append(models.UsageLog.start_time >= start)
+    if end is not None:
+        clauses.append(models.UsageLog.start_time < end)
+    if device_id is not None:
+        clauses.append(models.UsageLog.device_id == device_id)
+    return clauses
+
+
+def device_usage_counts_python(db: Session, filters: list):
+    """在 Python 中逐行统计 (device_id, 日期, 次数) 与 (device_id, 小时, 次数)"""
+    daily = Counter()
+    hourly = Counter()
+    rows = db.query(models.UsageLog.device_id, models.UsageLog.start_time,
+                    models.UsageLog.finish_time).filter(*filters)
+    for device_id, start_time, finish_time in rows:
+        if start_time:
+            daily[(device_id, str(start_time.date()))] += 1
+        if start_time and finish_time:
+            for hour in range(start_time.hour, finish_time.hour + 1):
+                hourly[(device_id, hour)] += 1
+    return ((d, day, n) for (d, day), n in daily.items()), ((d, h, n) for (d, h), n in hourly.items())
+
+
+def _day_expr(db: Session, column):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date_trunc("day", column).label("day")
+    return func.date(column).label("day")
+
+
+def _hours_table(db: Session):
+    """0-23 的小时表：PostgreSQL 用 generate_series，其他数据库用字面量"""
+    if db.get_bind().dialect.name == "postgresql":
+        return select(func.generate_series(0, 23).column_valued("hour")).subquery()
+    return union_all(*(select(literal(h).label("hour")) for h in range(24))).subquery()
+
+
+def _format_daily(rows):
+    return ((d, str(v.date() if isinstance(v, datetime) else v), n) for d, v, n in rows)
+
+
+def device_usage_counts_sql(db: Session, filters: list):
+    """在数据库中用 GROUP BY 完成按天计数与小时分布统计"""
+    log = models.UsageLog
+    day = _day_expr(db, log.start_time)
+    hours = _hours_table(db)
+
+    daily = db.execute(
+        select(log.device_id, day, func.count())
+        .where(log.start_time.is_not(None), *filters)
+        .group_by(log.device_id, day)
+    ).all()
+
+    # 与逐行实现一致：覆盖 start_hour..end_hour 之间的每个小时（跨零点时不计）
+    start_hour = cast(extract("hour", log.start_time), Integer)
+    end_hour = cast(extract("hour", log.finish_time), Integer)
+    hourly = db.execute(
+        select(log.device_id, hours.c.hour, func.count())
+        .select_from(log)
+        .join(hours, hours.c.hour.between(start_hour, end_hour))
+        .where(log.start_time.is_not(None), log.finish_time.is_not(None), *filters)
+        .group_by(log.device_id, hours.c.hour)
+    ).all()
+
+    return _format_daily(daily), ((d, int(h), n) for d, h, n in hourly)
+
+
+def rollup_filters(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   device_id: Optional[int] = None) -> list:
+    """rollup 按整点聚合，时间窗口以整点为粒度生效"""
+    rollup = models.UsageHourlyRollup
+    clauses = []
+    if start is not None:
+        clauses.append(rollup.hour >= start.replace(minute=0, second=0, microsecond=0))
+    if end is not None:
+        clauses.append(rollup.hour < end)
+    if device_id is not None:
+        clauses.append(rollup.device_id == device_id)
+    return clauses
+
+
+def device_usage_counts_rollup(db: Session, filters: list):
+    """从 usage_hourly_rollups 读取按天计数与小时分布，开销与设备数 × 小时数相关"""
+    rollup = models.UsageHourlyRollup
+    day = _day_expr(db, rollup.hour)
+    hours = _hours_table(db)
+
+    daily = db.execute(
+        select(rollup.device_id, day, func.sum(rollup.session_count))
+        .where(*filters)
+        .group_by(rollup.device_id, day)
+        .having(func.sum(rollup.session_count) > 0)
+    ).all()
+
+    start_hour = cast(extract("hour", rollup.hour), Integer)
+    hourly = db.execute(
+        select(rollup.device_id, hours.c.hour, func.sum(rollup.session_count))
+        .select_from(rollup)
+        .join(hours, hours.c.hour.between(start_hour, rollup.end_hour))
+        .where(*filters)
+        .group_by(rollup.device_id, hours.c.hour)
+        .having(func.sum(rollup.session_count) > 0)
+    ).all()
+
+    return _format_daily(daily), ((d, int(h), int(n)) for d, h, n in hourly)
+
+
+def device_usage_counts_with_history(db: Session, count_raw, start: Optional[datetime] = None,
+                                     end: Optional[datetime] = None, device_id: Optional[int] = None,
+                                     cutoff: Optional[datetime] = None):
+    """cutoff 之前的原始记录已被压缩：这部分读 rollup，之后用 count_raw 统计原始记录"""
+    if cutoff is None:
+        return count_raw(db, usage_log_filters(start, end, device_id))
+    raw_start = cutoff if start is None else max(start, cutoff)
+    daily, hourly = count_raw(db, usage_log_filters(raw_start, end, device_id))
+    if start is not None and start >= cutoff:
+        return daily, hourly
+    history_end = cutoff if end is None else min(end, cutoff)
+    old_daily, old_hourly = device_usage_counts_rollup(db, rollup_filters(start, history_end, device_id))
+    return chain(old_daily, daily), chain(old_hourly, hourly)
+
+
+def user_usage_counts_rollup(db: Session) -> Dict[int, int]:
+    """每个用户的使用次数"""
+    rollup = models.UsageHourlyRollup
+    rows = db.execute(
+        select(rollup.user_id, func.sum(rollup.session_count))
+        .group_by(rollup.user_id)
+        .having(func.sum(rollup.session_count) > 0)
+    )
+    return {user_id: int(count) for user_id, count in rows}
+
+
+def summarize_device_usage(daily_counts, hourly_counts, device_map: Dict[int, str]) -> dict:
+    """按设备名汇总计数，输出 /analysis/device-usage 的响应结构"""
+    daily_usage_freq = defaultdict(lambda: defaultdict(int))
+    hourly_distribution = defaultdict(lambda: defaultdict(int))
+
+    for device_id, day, count in daily_counts:
+        daily_usage_freq[device_map.get(device_id, "Unknown")][day] += count
+    for device_id, hour, count in hourly_counts:
+        hourly_distribution[device_map.get(device_id, "Unknown")][hour] += count
+
+    # 计算每天平均使用频率
+    average_daily_freq = {}
+    for device, day_counts in daily_usage_freq.items():
+        total_usage = sum(day_counts.values())
+        num_days = len(day_counts)
+        average = total_usage / num_days if num_days else 0
+        average_daily_freq[device] = round(average, 2)
+
+    return {
+        "daily_usage_frequency": {
+            device: dict(date_counts) for device, date_counts in daily_usage_freq.items()
+        },
+        "average_daily_frequency": average_daily_freq,
+        "hourly_distribution": {
+            device: dict(hour_dist) for device, hour_dist in hourly_distribution.items()
+        }
+    }
+
+
+# ------------------ 按时长加权的使用分钟数 ------------------ #
+USAGE_BUCKET_MINUTES = (15, 60, 1440)
+# 不折叠时 设备数 × 桶数 的上限，超过时需要缩小时间窗口或加宽桶
+MAX_TIMELINE_CELLS = int(os.environ.get("USAGE_MINUTES_MAX_CELLS", "5000000"))
+LOAD_BATCH_SIZE = 10000
+_MICROS_PER_MINUTE = 60_000_000
+
+
+def _micros(value: datetime) -> int:
+    import numpy as np
+
+    return int(np.datetime64(value, "us").astype(np.int64))
+
+
+def usage_interval_arrays(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          device_id: Optional[int] = None):
+    """(device_id, 开始, 结束) 三列 int64 数组（微秒），按窗口 [start, end) 裁剪；未结束或时长为 0 的记录不计"""
+    import numpy as np
+
+    log = models.UsageLog
+    stmt = select(log.device_id, log.start_time, log.finish_time).where(
+        log.start_time.is_not(None), log.finish_time > log.start_time
+    )
+    # 与窗口有重叠的记录都参与，包括窗口开始前已在使用的
+    if start is not None:
+        stmt = stmt.where(log.finish_time > start)
+    if end is not None:
+        stmt = stmt.where(log.start_time < end)
+    if device_id is not None:
+        stmt = stmt.where(log.device_id == device_id)
+
+    parts = []
+    for rows in db.execute(stmt.execution_options(yield_per=LOAD_BATCH_SIZE)).partitions():
+        device_ids, starts, finishes = zip(*rows)
+        parts.append((
+            np.asarray([d if d is not None else -1 for d in device_ids], dtype=np.int64),
+            np.asarray(starts, dtype="datetime64[us]").astype(np.int64),
+            np.asarray(finishes, dtype="datetime64[us]").astype(np.int64),
+        ))
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    device_ids, starts, finishes = (np.concatenate(column) for column in zip(*parts))
+    if start is not None:
+        np.maximum(starts, _micros(start), out=starts)
+    if end is not None:
+        np.minimum(finishes, _micros(end), out=finishes)
+    keep = finishes > starts
+    return device_ids[keep], starts[keep], finishes[keep]
+
+
+def _bucket_sums(rows, n_rows: int, first, last, head, tail, period: int, width: int):
+    """把每条记录 [首桶, 尾桶] 的时长累加到长度为 period 的环上（桶号取模），返回 (n_rows, period) 矩阵
+
+    首尾两个不完整的桶直接按时长累加；中间的整桶先按整圈数平铺，余下的一段用差分数组标记后做前缀和，
+    因此总开销为 O(记录数 + n_rows × period)，与记录跨越多少个桶无关。
+    """
+    import numpy as np
+
+    size = n_rows * period
+    first_pos, last_pos = first % period, last % period
+    sums = np.bincount(rows * period + first_pos, weights=head, minlength=size)
+    sums += np.bincount(rows * period + last_pos, weights=tail, minlength=size)
+
+    full = np.maximum(last - first - 1, 0)
+    laps, rest = np.divmod(full, period)
+    covered = np.bincount(rows, weights=laps, minlength=n_rows)[:, None] * np.ones(period)
+
+    # 余下的 rest 个整桶从首桶的下一个开始，越过环的末尾时拆成两段
+    begin = (first_pos + 1) % period
+    stop = begin + rest
+    wraps = stop > period
+    stride = period + 1
+    has_rest = rest > 0
+    marks = (
+        np.bincount(rows[has_rest] * stride + begin[has_rest], minlength=n_rows * stride)
+        - np.bincount(rows[has_rest] * stride + np.minimum(stop, period)[has_rest], minlength=n_rows * stride)
+        + np.bincount(rows[wraps] * stride, minlength=n_rows * stride)
+        - np.bincount(rows[wraps] * stride + (stop - period)[wraps], minlength=n_rows * stride)
+    )
+    covered += np.cumsum(marks.reshape(n_rows, stride), axis=1)[:, :period]
+    return sums.reshape(n_rows, period) + covered * width
+
+
+def usage_minutes_histogram(device_ids, starts, finishes, bucket_minutes: int = 60, fold: bool = True,
+                            max_cells: int = MAX_TIMELINE_CELLS):
+    """按实际使用时长统计每台设备在每个桶内的使用分钟数
+
+    桶从零点开始对齐；fold=True 时把所有日期折叠到一天内（时段分布），否则按时间轴展开。
+    返回 (设备 id 数组, 各桶起点, 分钟数矩阵[设备, 桶])：折叠时起点为距零点的分钟数，否则为微秒时间戳
+    """
+    import numpy as np
+
+    width = bucket_minutes * _MICROS_PER_MINUTE
+    devices, rows = np.unique(device_ids, return_inverse=True)
+    if not len(devices):
+        bucket_starts = np.arange(0, 24 * 60, bucket_minutes) if fold else np.empty(0, dtype=np.int64)
+        return devices, bucket_starts, np.zeros((0, len(bucket_starts)))
+    first = starts // width
+    last = (finishes - 1) // width  # 结束时刻不计入，正好落在桶边界时属于前一个桶
+    same = first == last
+    head = np.where(same, finishes - starts, (first + 1) * width - starts)
+    tail = np.where(same, 0, finishes - last * width)
+
+    if fold:
+        period = 24 * 60 // bucket_minutes
+        origin = 0  # 时间戳以 1970-01-01 零点为原点，桶号取模即为当天的第几个桶
+        bucket_starts = np.arange(period, dtype=np.int64) * bucket_minutes
+    else:
+        origin = int(first.min())
+        period = int(last.max()) - origin + 1
+        if len(devices) * period > max_cells:
+            raise ValueError(f"{len(devices)} devices x {period} buckets exceeds {max_cells} cells; "
+                             "narrow the time window or use a wider bucket")
+        bucket_starts = (origin + np.arange(period, dtype=np.int64)) * width
+
+    sums = _bucket_sums(rows, len(devices), first - origin, last - origin, head, tail, period, width)
+    return devices, bucket_starts, sums / _MICROS_PER_MINUTE
+
+
+def summarize_usage_minutes(devices, bucket_starts, minutes, bucket_minutes: int, fold: bool,
+                            device_map: Dict[int, str]) -> dict:
+    """按设备名汇总，输出 /analysis/usage-minutes 的响应结构；不折叠时只列出有使用的桶"""
+    import numpy as np
+
+    if fold:
+        labels = [f"{m // 60:02d}:{m % 60:02d}" for m in bucket_starts.tolist()]
+    else:
+        unit = "D" if bucket_minutes == 24 * 60 else "m"
+        labels = np.datetime_as_string(bucket_starts.astype("datetime64[us]"), unit=unit).tolist()
+
+    by_name = {}
+    for device_id, row in zip(devices.tolist(), minutes):
+        name = device_map.get(device_id, "Unknown")
+        by_name[name] = by_name[name] + row if name in by_name else row
+    total = minutes.sum(axis=0) if len(minutes) else np.zeros(len(labels))
+
+    def series(values):
+        values = np.round(values, 2).tolist()
+        if fold:
+            return dict(zip(labels, values))
+        return {label: value for label, value in zip(labels, values) if value}
+
+    return {
+        "bucket_minutes": bucket_minutes,
+        "fold": "day" if fold else "none",
+        "minutes": {name: series(row) for name, row in sorted(by_name.items())},
+        "total": series(total),
+    }
+
+
+# ------------------ 房屋面积与使用频率 ------------------ #
+def classify_correlation(corr: float) -> str:
+    """将皮尔逊系数转化为语言描述"""
+    if abs(corr) > 0.7:
+        return "强相关"
+    elif abs(corr) > 0.4:
+        return "中相关"
+    elif abs(corr) > 0.2:
+        return "弱相关"
+    else:
+        return "无明显相关"
+
+
+DEFAULT_AREA_BINS = (80.0, 120.0)
+DEFAULT_AREA_LABELS = ("小户型 (<=80㎡)", "中户型 (81-120㎡)", "大户型 (>120㎡)")
+
+
+def area_bin_labels(edges: Tuple[float, ...]) -> List[str]:
+    if tuple(edges) == DEFAULT_AREA_BINS:
+        return list(DEFAULT_AREA_LABELS)
+    fmt = lambda x: f"{x:g}"
+    labels = [f"<={fmt(edges[0])}㎡"]
+    labels += [f"{fmt(lo)}-{fmt(hi)}㎡" for lo, hi in zip(edges, edges[1:])]
+    labels.append(f">{fmt(edges[-1])}㎡")
+    return labels
+
+
+def user_area_usage_arrays(db: Session):
+    """一次聚合查询取出 (user_id, house_area, usage_count) 三列数组"""
+    import numpy as np
+
+    user = models.User
+    rollup = models.UsageHourlyRollup
+    usage = func.sum(rollup.session_count)
+    rows = db.execute(
+        select(user.id, user.house_area, usage)
+        .join(rollup, rollup.user_id == user.id)
+        .where(user.house_area.is_not(None), user.house_area != 0)
+        .group_by(user.id, user.house_area)
+        .having(usage > 0)
+        .order_by(user.id)
+    ).all()
+    table = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return table[:, 0].astype(np.int64), table[:, 1], table[:, 2].astype(np.int64)
+
+
+def area_vs_usage_stats(user_ids, areas, usages, edges: Tuple[float, ...] = DEFAULT_AREA_BINS,
+                        include_raw: bool = True, raw_offset: int = 0, raw_limit: Optional[int] = None) -> dict:
+    """相关性、分组统计与异常用户识别，全部按列向量化计算；numpy 在首次调用时才导入"""
+    import numpy as np
+
+    # 相关性分析
+    corr = float(np.corrcoef(areas, usages)[0, 1]) if len(areas) > 1 else float("nan")
+    if np.isfinite(corr):
+        correlation_coefficient, correlation_strength = round(corr, 4), classify_correlation(corr)
+    else:
+        correlation_coefficient, correlation_strength = None, classify_correlation(0.0)
+
+    # 分区域分组分析：right=True 与 <= 边界的划分一致
+    groups = np.digitize(areas, edges, right=True)
+    n_groups = len(edges) + 1
+    counts = np.bincount(groups, minlength=n_groups)
+    sums = np.bincount(groups, weights=usages, minlength=n_groups)
+    area_stats = {
+        label: {
+            "user_count": int(counts[g]),
+            "avg_usage": float(sums[g] / counts[g]) if counts[g] else 0
+        }
+        for g, label in enumerate(area_bin_labels(edges))
+    }
+
+    # 异常用户识别：最大一档房型低使用 / 最小一档房型高使用
+    usage_mean = usages.mean()
+    usage_std = usages.std()
+    threshold_low = usage_mean - 1.2 * usage_std
+    threshold_high = usage_mean + 1.2 * usage_std
+    large_low = (groups == n_groups - 1) & (usages < threshold_low)
+    small_high = (groups == 0) & (usages > threshold_high)
+    reasons = np.full(len(user_ids), None, dtype=object)
+    reasons[large_low] = "大房低使用"
+    reasons[small_high] = "小房高使用"
+
+    def rows(index):
+        result = []
+        for i in index:
+            row = {"user_id": int(user_ids[i]), "house_area": float(areas[i]), "usage_count": int(usages[i])}
+            if reasons[i] is not None:
+                row["outlier_reason"] = reasons[i]
+            result.append(row)
+        return result
+
+    result = {
+        "summary": {
+            "total_users": int(len(user_ids)),
+            "correlation_coefficient": correlation_coefficient,
+            "correlation_strength": correlation_strength,
+            "avg_area": float(areas.mean()),
+            "avg_usage": float(usage_mean),
+            "max_area": float(areas.max()),
+            "max_usage": float(usages.max()),
+            "min_area": float(areas.min()),
+            "min_usage": float(usages.min()),
+        },
+        "group_analysis": area_stats,
+        "outliers": rows(np.flatnonzero(large_low | small_high)),
+    }
+    if include_raw:
+        stop = len(user_ids) if raw_limit is None else min(len(user_ids), raw_offset + raw_limit)
+        result["raw_data"] = rows(range(raw_offset, stop))
+    return result
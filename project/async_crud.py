@@ -0,0 +1,110 @@
+from typing import List, Type
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models, schemas, pagination, rollups, cache, serialization, alerts
+from database import AsyncSessionLocal
+
+# asyncio 版本的 CRUD 接口，挂载在 /async 下，与同步接口行为一致
+router = APIRouter(prefix="/async", tags=["async"])
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _ndjson_stream(model, schema: Type[BaseModel], page: pagination.PageParams) -> StreamingResponse:
+    async def generate():
+        async with AsyncSessionLocal() as db:
+            if pagination.FAST_READS:
+                keys, stmt = pagination.column_select(model, schema, page.after_id, page.limit)
+                result = await db.stream(stmt.execution_options(yield_per=pagination.STREAM_BATCH_SIZE))
+                async for rows in result.partitions():
+                    yield pagination.encode_ndjson(keys, rows)
+                return
+            stmt = pagination.keyset(select(model), model.id, page.after_id, page.limit)
+            rows = await db.stream_scalars(stmt.execution_options(yield_per=pagination.STREAM_BATCH_SIZE))
+            async for row in rows:
+                yield schema.model_validate(row).model_dump_json().encode() + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+def register_crud(path: str, model, schema: Type[BaseModel], create_schema: Type[BaseModel],
+                  label: str, cache_tag: str = None, track_rollups: bool = False, check_alerts: bool = False):
+    """为一个资源注册 create / list / update / delete 四个异步接口"""
+    not_found = f"{label} not found"
+
+    def _check_alerts(session, obj):
+        # 与同步接口一致：新记录命中的告警与记录在同一事务中提交
+        session.flush()
+        return alerts.check_new_logs(session, [(obj.id, *rollups.log_row(obj))])
+
+    async def _after_write(db: AsyncSession, old_row=None, new_row=None, created=None):
+        if track_rollups:
+            if old_row is not None:
+                await db.run_sync(lambda s: rollups.apply(s, [old_row], sign=-1))
+            if new_row is not None:
+                await db.run_sync(lambda s: rollups.apply(s, [new_row]))
+        flagged = []
+        if check_alerts and created is not None:
+            flagged = await db.run_sync(_check_alerts, created)
+        await db.commit()
+        if cache_tag:
+            cache.invalidate(cache_tag)
+        alerts.publish(flagged)
+
+    @router.post(path, response_model=schema)
+    async def create(item: create_schema, db: AsyncSession = Depends(get_async_db)):
+        obj = model(**item.model_dump())
+        db.add(obj)
+        await _after_write(db, new_row=rollups.log_row(obj) if track_rollups else None, created=obj)
+        await db.refresh(obj)
+        return obj
+
+    @router.get(path, response_model=List[schema])
+    async def list_items(page: pagination.PageParams = Depends(), db: AsyncSession = Depends(get_async_db)):
+        if page.stream:
+            return _ndjson_stream(model, schema, page)
+        if pagination.FAST_READS:
+            keys, stmt = pagination.column_select(model, schema, page.after_id, page.limit)
+            return serialization.FastJSONResponse(serialization.rows_to_dicts(keys, await db.execute(stmt)))
+        stmt = pagination.keyset(select(model), model.id, page.after_id, page.limit)
+        return (await db.scalars(stmt)).all()
+
+    @router.put(path + "/{item_id}", response_model=schema)
+    async def update(item_id: int, updated: create_schema, db: AsyncSession = Depends(get_async_db)):
+        obj = await db.get(model, item_id)
+        if not obj:
+            raise HTTPException(status_code=404, detail=not_found)
+        old_row = rollups.log_row(obj) if track_rollups else None
+        for key, value in updated.model_dump().items():
+            setattr(obj, key, value)
+        await _after_write(db, old_row, rollups.log_row(obj) if track_rollups else None)
+        await db.refresh(obj)
+        return obj
+
+    @router.delete(path + "/{item_id}")
+    async def delete(item_id: int, db: AsyncSession = Depends(get_async_db)):
+        obj = await db.get(model, item_id)
+        if not obj:
+            raise HTTPException(status_code=404, detail=not_found)
+        old_row = rollups.log_row(obj) if track_rollups else None
+        await db.delete(obj)
+        await _after_write(db, old_row=old_row)
+        return {"detail": f"{label} deleted"}
+
+
+register_crud("/users", models.User, schemas.User, schemas.UserCreate, "User", cache_tag="users")
+register_crud("/devices", models.Device, schemas.Device, schemas.DeviceCreate, "Device", cache_tag="devices")
+register_crud("/usagelogs", models.UsageLog, schemas.UsageLog, schemas.UsageLogCreate, "Usage log",
+              cache_tag="usage_logs", track_rollups=True, check_alerts=True)
+register_crud("/securityevents", models.SecurityEvent, schemas.SecurityEvent, schemas.SecurityEventCreate,
+              "Security event", cache_tag="security_events")
+register_crud("/feedbacks", models.Feedback, schemas.Feedback, schemas.FeedbackCreate, "Feedback",
+              cache_tag="feedbacks")
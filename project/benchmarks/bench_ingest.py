@@ -0,0 +1,72 @@
+"""对比逐行 POST /usagelogs 与批量 POST /usagelogs/bulk 的写入吞吐 (rows/sec)
+
+用法: 先启动服务 (uvicorn main:app --port 8000)，再运行
+    python benchmarks/bench_ingest.py --single 500 --bulk 50000
+
+依赖 httpx (pip install httpx)。
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:8000")
+
+
+def make_rows(n, user_id, device_id):
+    base = datetime(2024, 1, 1)
+    rows = []
+    for _ in range(n):
+        start = base + timedelta(minutes=random.randint(0, 60 * 24 * 30))
+        finish = start + timedelta(minutes=random.randint(1, 120))
+        rows.append({
+            "user_id": user_id,
+            "device_id": device_id,
+            "start_time": start.isoformat(),
+            "finish_time": finish.isoformat(),
+        })
+    return rows
+
+
+def report(label, n, elapsed):
+    print(f"{label:<24} {n:>8} rows  {elapsed:8.2f} s  {n / elapsed:>10.0f} rows/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--single", type=int, default=500, help="逐行写入的行数")
+    parser.add_argument("--bulk", type=int, default=50000, help="批量写入的行数")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--method", choices=["insert", "copy"], default="insert")
+    args = parser.parse_args()
+
+    # 保持连接复用，逐行写入的耗时不包含建连
+    session = httpx.Client(timeout=None)
+    user = session.post(f"{BASE_URL}/users", json={"name": "bench", "house_area": 100}).json()
+    device = session.post(f"{BASE_URL}/devices", json={"name": "bench_device", "type": "light"}).json()
+
+    rows = make_rows(args.single, user["id"], device["id"])
+    t0 = time.perf_counter()
+    for row in rows:
+        session.post(f"{BASE_URL}/usagelogs", json=row).raise_for_status()
+    report("single-row POST", len(rows), time.perf_counter() - t0)
+
+    params = {"chunk_size": args.chunk_size, "method": args.method}
+    rows = make_rows(args.bulk, user["id"], device["id"])
+    t0 = time.perf_counter()
+    result = session.post(f"{BASE_URL}/usagelogs/bulk", params=params, json=rows).json()
+    report(f"bulk JSON ({args.method})", result["inserted"], time.perf_counter() - t0)
+
+    body = "\n".join(json.dumps(row) for row in rows)
+    t0 = time.perf_counter()
+    result = session.post(f"{BASE_URL}/usagelogs/bulk", params=params, content=body.encode(),
+                          headers={"Content-Type": "application/x-ndjson"}).json()
+    report(f"bulk NDJSON ({args.method})", result["inserted"], time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""同步与异步 CRUD 接口的并发压测 (requests/sec)
+
+用法: 以 DB_ASYNC=1 启动服务 (DB_ASYNC=1 uvicorn main:app --port 8000 --workers 1)，再运行
+    python benchmarks/bench_load.py --requests 2000 --concurrency 64
+
+依赖 httpx (pip install httpx)。
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:8000")
+
+
+async def run(client, method, path, total, concurrency, json=None):
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    failures = 0
+
+    async def worker():
+        nonlocal failures
+        while not queue.empty():
+            queue.get_nowait()
+            response = await client.request(method, path, json=json)
+            if response.status_code >= 400:
+                failures += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - t0, failures
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=BASE_URL, limits=limits, timeout=60) as client:
+        user = (await client.post("/users", json={"name": "load", "house_area": 90})).json()
+        device = (await client.post("/devices", json={"name": "load_device", "type": "light"})).json()
+        log = {"user_id": user["id"], "device_id": device["id"],
+               "start_time": "2024-01-01T08:00:00", "finish_time": "2024-01-01T08:30:00"}
+
+        cases = [
+            ("GET", "/users?limit=50", None),
+            ("GET", "/usagelogs?limit=100", None),
+            ("POST", "/usagelogs", log),
+        ]
+        print(f"{'case':<28} {'sync req/s':>12} {'async req/s':>12}")
+        for method, path, body in cases:
+            results = []
+            for prefix in ("", "/async"):
+                elapsed, failures = await run(client, method, prefix + path, args.requests, args.concurrency, body)
+                if failures:
+                    print(f"  {prefix + path}: {failures} failed requests")
+                results.append(args.requests / elapsed)
+            print(f"{method + ' ' + path:<28} {results[0]:>12.0f} {results[1]:>12.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+"""列表接口的读路径对比（分页与全表 NDJSON 流）：按列查询 + 直接编码 (FAST_READS=1) 与 ORM 对象 + Pydantic 逐行校验 (FAST_READS=0)
+
+进程内调用接口，数据库由 DATABASE_URL 指定（可先用 datagen.py 生成数据）:
+    DATABASE_URL=sqlite:///bench.db python benchmarks/bench_serialization.py --limit 10000 --repeat 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("RESULT_CACHE_TTL", "0")
+
+from fastapi.testclient import TestClient
+
+import pagination, serialization
+from main import app
+
+
+def measure(client, path, params, repeat):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        response = client.get(path, params=params)
+        size = len(response.content)
+        timings.append(time.perf_counter() - t0)
+        response.raise_for_status()
+    return statistics.median(timings), size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=10000, help="每页行数（上限 10000）")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if serialization.orjson is not None else 'json'}")
+    client = TestClient(app)
+    if not client.get("/securityevents", params={"limit": 1}).json():
+        client.get("/auto-alarm-check")  # 生成的数据没有安防事件，先跑一次告警检查
+    for path in ("/usagelogs", "/securityevents"):
+        for label, params in (("page", {"limit": args.limit}), ("stream", {"stream": "true"})):
+            results = {}
+            for fast in (False, True):
+                pagination.FAST_READS = fast
+                measure(client, path, params, 1)  # 预热
+                results[fast] = measure(client, path, params, args.repeat)
+            (slow, size), (fast, _) = results[False], results[True]
+            print(f"{path:<16} {label:<7} {size / 1024:10.0f} KiB  pydantic {slow * 1000:9.1f} ms  "
+                  f"fast {fast * 1000:9.1f} ms  {slow / fast:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""测量导入 main（即每个 uvicorn worker 启动）的耗时与常驻内存
+
+    python benchmarks/bench_startup.py --runs 5
+
+默认使用临时 SQLite 数据库，可通过 DATABASE_URL 指定其他数据库。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import resource, sys, time
+t0 = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - t0
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = sorted(m for m in ("matplotlib", "seaborn", "scipy", "numpy") if m in sys.modules)
+print(elapsed, rss_kb, ",".join(heavy) or "-")
+"""
+
+CASES = {
+    "import main": "import main",
+    "import main + analysis stack": "import main\nimport numpy, scipy.stats, matplotlib.pyplot, seaborn",
+}
+
+
+def measure(imports, env):
+    out = subprocess.run([sys.executable, "-c", PROBE.format(imports=imports)], cwd=PROJECT_DIR,
+                         env=env, capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), int(out[1]) / 1024, out[2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'startup.db')}")
+        print(f"{'case':<32} {'median s':>9} {'max RSS MB':>11}  heavy modules loaded")
+        for label, imports in CASES.items():
+            samples = [measure(imports, env) for _ in range(args.runs)]
+            elapsed = statistics.median(s[0] for s in samples)
+            rss = statistics.median(s[1] for s in samples)
+            print(f"{label:<32} {elapsed:>9.3f} {rss:>11.1f}  {samples[-1][2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""按时长加权的使用分钟数：向量化实现与逐条逐桶累加实现的正确性对照与耗时
+
+    python benchmarks/bench_usage_minutes.py --sessions 2000000 --check 20000
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+
+MINUTE = 60_000_000
+
+
+def make_sessions(n, devices, seed=0):
+    """微秒时间戳；包含 0 分钟、跨零点、跨多天以及恰好落在桶边界的记录"""
+    rng = np.random.default_rng(seed)
+    base = int(np.datetime64("2024-01-01T00:00", "us").astype(np.int64))
+    starts = base + rng.integers(0, 60 * 24 * 90, n) * MINUTE + rng.integers(0, MINUTE, n)
+    lengths = rng.choice([1, 59, 60, 61, 15 * 60, 24 * 60 * 60, 3 * 24 * 60 * 60 + 7, 9 * 24 * 60 * 60], n)
+    durations = rng.integers(0, lengths * 1_000_000 + 1)
+    edge = rng.random(n) < 0.1
+    durations[edge] = (-starts[edge]) % (15 * MINUTE) + rng.integers(0, 3, edge.sum()) * 15 * MINUTE
+    return rng.integers(1, devices + 1, n), starts, starts + durations
+
+
+def reference(device_ids, starts, finishes, bucket_minutes, fold):
+    """逐条记录、逐个桶计算重叠时长"""
+    width = bucket_minutes * MINUTE
+    per_day = 24 * 60 // bucket_minutes
+    sums = defaultdict(int)
+    for device_id, start, finish in zip(device_ids.tolist(), starts.tolist(), finishes.tolist()):
+        bucket = start // width
+        while bucket * width < finish:
+            overlap = min(finish, (bucket + 1) * width) - max(start, bucket * width)
+            sums[(device_id, bucket % per_day if fold else bucket)] += overlap
+            bucket += 1
+    return sums
+
+
+def check(device_ids, starts, finishes, bucket_minutes, fold):
+    devices, bucket_starts, minutes = analysis.usage_minutes_histogram(
+        device_ids, starts, finishes, bucket_minutes, fold, max_cells=10 ** 9
+    )
+    width = bucket_minutes * MINUTE
+    buckets = bucket_starts // bucket_minutes if fold else bucket_starts // width
+    expected = reference(device_ids, starts, finishes, bucket_minutes, fold)
+    for i, device_id in enumerate(devices.tolist()):
+        for j, bucket in enumerate(buckets.tolist()):
+            want = expected.pop((device_id, bucket), 0) / MINUTE
+            assert abs(minutes[i, j] - want) < 1e-6, (device_id, bucket, minutes[i, j], want)
+    assert not any(expected.values()), "buckets missing from the histogram"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2_000_000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--check", type=int, default=20_000, help="对照检查使用的记录数")
+    args = parser.parse_args()
+
+    sample = make_sessions(args.check, args.devices, seed=1)
+    for bucket_minutes in analysis.USAGE_BUCKET_MINUTES:
+        for fold in (True, False):
+            check(*sample, bucket_minutes, fold)
+    print(f"correctness: {args.check} sessions, buckets {analysis.USAGE_BUCKET_MINUTES}, fold/timeline ok")
+
+    data = make_sessions(args.sessions, args.devices)
+    for bucket_minutes in analysis.USAGE_BUCKET_MINUTES:
+        for fold in (True, False):
+            t0 = time.perf_counter()
+            _, _, minutes = analysis.usage_minutes_histogram(*data, bucket_minutes, fold, max_cells=10 ** 9)
+            elapsed = time.perf_counter() - t0
+            print(f"bucket {bucket_minutes:>4} min  fold={'day ' if fold else 'none'}  "
+                  f"{args.sessions / elapsed / 1e6:6.1f}M sessions/s  ({elapsed * 1000:.0f} ms, "
+                  f"{minutes.shape[0]}x{minutes.shape[1]} cells)")
+
+    n = min(args.sessions, 200_000)
+    t0 = time.perf_counter()
+    reference(data[0][:n], data[1][:n], data[2][:n], 60, True)
+    print(f"per-bucket python loop: {n / (time.perf_counter() - t0) / 1e6:6.2f}M sessions/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""单行写接口的吞吐对比：逐行提交 (WRITE_BEHIND=off) 与合并写入 (WRITE_BEHIND=flush)
+
+每种模式在独立子进程中运行（模式在导入时读取），多个线程并发调用 POST /usagelogs 与 POST /securityevents:
+    DATABASE_URL=sqlite:///bench.db python benchmarks/bench_writebehind.py --requests 5000 --concurrency 32
+PostgreSQL 上可再加 --modes off,flush,reserve
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(n_requests: int, concurrency: int):
+    sys.path.insert(0, PROJECT_DIR)
+    os.environ.setdefault("RESULT_CACHE_TTL", "0")
+    from fastapi.testclient import TestClient
+
+    import models
+    from database import SessionLocal
+    from main import app
+
+    db = SessionLocal()
+    user_id = db.query(models.User.id).order_by(models.User.id).limit(1).scalar()
+    device_id = (db.query(models.Device.id).filter(models.Device.type == "light").limit(1).scalar()
+                 or db.query(models.Device.id).limit(1).scalar())
+    db.close()
+    if user_id is None or device_id is None:
+        raise SystemExit("need at least one user and device (run datagen.py first)")
+
+    client = TestClient(app)
+    base = datetime(2023, 6, 1, 12)
+
+    def post(i):
+        # 白天短时间使用，不触发告警
+        start = base + timedelta(seconds=i)
+        if i % 2:
+            body = {"user_id": user_id, "event": "bench", "timestamp": start.isoformat()}
+            return client.post("/securityevents", json=body).status_code
+        body = {"user_id": user_id, "device_id": device_id, "start_time": start.isoformat(),
+                "finish_time": (start + timedelta(minutes=5)).isoformat()}
+        return client.post("/usagelogs", json=body).status_code
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        statuses = list(pool.map(post, range(n_requests)))
+    elapsed = time.perf_counter() - t0
+    stats = client.get("/writebehind").json()
+    print(json.dumps({"seconds": elapsed, "errors": sum(s != 200 for s in statuses), "stats": stats}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--modes", default="off,flush")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.requests, args.concurrency)
+        return
+
+    for mode in args.modes.split(","):
+        env = {**os.environ, "WRITE_BEHIND": mode}
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", mode,
+             "--requests", str(args.requests), "--concurrency", str(args.concurrency)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<8} {args.requests / result['seconds']:8.0f} req/s  errors {result['errors']}  "
+              f"batches {result['stats'].get('batches', '-')}")
+    print("bench rows are dated 2023-06-01; remove them with POST /usagelogs/bulk-delete and /securityevents/bulk-delete")
+
+
+if __name__ == "__main__":
+    main()
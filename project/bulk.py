@@ -0,0 +1,191 @@
+from typing import Callable, Iterator, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+import models, schemas, rollups, intervals, alerts
+
+# 不分批提交时，IN 列表与 rollup 增量的内部批大小
+DEFAULT_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 100000
+
+
+# ------------------ 过滤条件 ------------------ #
+def usage_log_clauses(f: schemas.UsageLogFilter) -> list:
+    log = models.UsageLog
+    clauses = []
+    if f.ids is not None:
+        clauses.append(log.id.in_(f.ids))
+    if f.user_id is not None:
+        clauses.append(log.user_id == f.user_id)
+    if f.device_id is not None:
+        clauses.append(log.device_id == f.device_id)
+    if f.start is not None:
+        clauses.append(log.start_time >= f.start)
+    if f.end is not None:
+        clauses.append(log.start_time < f.end)
+    return _require(clauses)
+
+
+def security_event_clauses(f: schemas.SecurityEventFilter) -> list:
+    event = models.SecurityEvent
+    clauses = []
+    if f.ids is not None:
+        clauses.append(event.id.in_(f.ids))
+    if f.user_id is not None:
+        clauses.append(event.user_id == f.user_id)
+    if f.usage_log_id is not None:
+        clauses.append(event.usage_log_id == f.usage_log_id)
+    if f.severity is not None:
+        clauses.append(event.severity == f.severity)
+    if f.start is not None:
+        clauses.append(event.timestamp >= f.start)
+    if f.end is not None:
+        clauses.append(event.timestamp < f.end)
+    return _require(clauses)
+
+
+def _require(clauses: list) -> list:
+    # 防止空条件误改 / 误删整张表
+    if not clauses:
+        raise HTTPException(status_code=422, detail="At least one filter is required")
+    return clauses
+
+
+def _patch_values(patch) -> dict:
+    values = patch.model_dump(exclude_none=True)
+    if not values:
+        raise HTTPException(status_code=422, detail="No values to update")
+    return values
+
+
+def _check_references(db: Session, values: dict):
+    if "user_id" in values and db.get(models.User, values["user_id"]) is None:
+        raise HTTPException(status_code=422, detail=f"User {values['user_id']} not found")
+    if "device_id" in values and db.get(models.Device, values["device_id"]) is None:
+        raise HTTPException(status_code=422, detail=f"Device {values['device_id']} not found")
+
+
+# ------------------ 分批执行 ------------------ #
+def _id_chunks(db: Session, model, clauses: list, chunk_size: int) -> Iterator[List[int]]:
+    """按主键 keyset 逐批取出匹配的 id；已处理的行不会被重复选中"""
+    last_id = None
+    while True:
+        query = select(model.id).where(*clauses)
+        if last_id is not None:
+            query = query.where(model.id > last_id)
+        ids = db.scalars(query.order_by(model.id).limit(chunk_size)).all()
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def _run(db: Session, model, clauses: list, chunk_size: Optional[int],
+         per_chunk: Callable[[List[int]], int]) -> schemas.BulkWriteResult:
+    """chunk_size 为空时整体一个事务；否则每批单独提交，缩短持锁时间"""
+    affected, chunks = 0, 0
+    try:
+        for ids in _id_chunks(db, model, clauses, chunk_size or DEFAULT_CHUNK_SIZE):
+            affected += per_chunk(ids)
+            chunks += 1
+            if chunk_size:
+                db.commit()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return schemas.BulkWriteResult(affected=affected, chunks=chunks)
+
+
+# ------------------ 使用记录 ------------------ #
+def _usage_log_rows(db: Session, ids: List[int]):
+    """(id, user_id, device_id, start_time, finish_time)"""
+    log = models.UsageLog
+    return db.execute(
+        select(log.id, log.user_id, log.device_id, log.start_time, log.finish_time).where(log.id.in_(ids))
+    ).all()
+
+
+def update_usage_logs(db: Session, body: schemas.UsageLogBulkUpdate,
+                      chunk_size: Optional[int] = None) -> schemas.BulkWriteResult:
+    """批量修改使用记录，并在同一事务内把旧值移出、新值计入 rollup"""
+    clauses = usage_log_clauses(body.filter)
+    values = _patch_values(body.values)
+    _check_references(db, values)
+    log = models.UsageLog
+
+    def per_chunk(ids):
+        old_rows = _usage_log_rows(db, ids)
+        rollups.apply(db, (tuple(row[1:]) for row in old_rows), sign=-1)
+        db.execute(update(log).where(log.id.in_(ids)).values(**values),
+                   execution_options={"synchronize_session": False})
+        new_rows = [
+            (log_id, (values.get("user_id", user_id), values.get("device_id", device_id),
+                      values.get("start_time", start), values.get("finish_time", finish)))
+            for log_id, user_id, device_id, start, finish in old_rows
+        ]
+        rollups.apply(db, (row for _, row in new_rows))
+        intervals.stage(db, new_rows)
+        return len(old_rows)
+
+    return _run(db, log, clauses, chunk_size, per_chunk)
+
+
+def delete_usage_logs(db: Session, f: schemas.UsageLogFilter,
+                      chunk_size: Optional[int] = None) -> schemas.BulkWriteResult:
+    clauses = usage_log_clauses(f)
+    log = models.UsageLog
+
+    def per_chunk(ids):
+        old_rows = _usage_log_rows(db, ids)
+        rollups.apply(db, (tuple(row[1:]) for row in old_rows), sign=-1)
+        intervals.stage(db, [(row.id, None) for row in old_rows])
+        return db.execute(delete(log).where(log.id.in_(ids)),
+                          execution_options={"synchronize_session": False}).rowcount
+
+    return _run(db, log, clauses, chunk_size, per_chunk)
+
+
+# ------------------ 安防事件 ------------------ #
+def update_security_events(db: Session, body: schemas.SecurityEventBulkUpdate,
+                           chunk_size: Optional[int] = None) -> schemas.BulkWriteResult:
+    clauses = security_event_clauses(body.filter)
+    values = _patch_values(body.values)
+    _check_references(db, values)
+    event = models.SecurityEvent
+
+    if not chunk_size:
+        # 没有派生数据需要维护，直接一条 UPDATE
+        result = db.execute(update(event).where(*clauses).values(**values),
+                            execution_options={"synchronize_session": False})
+        db.commit()
+        return schemas.BulkWriteResult(affected=result.rowcount, chunks=1)
+
+    return _run(db, event, clauses, chunk_size, lambda ids: db.execute(
+        update(event).where(event.id.in_(ids)).values(**values),
+        execution_options={"synchronize_session": False},
+    ).rowcount)
+
+
+def delete_security_events(db: Session, f: schemas.SecurityEventFilter,
+                           chunk_size: Optional[int] = None) -> schemas.BulkWriteResult:
+    clauses = security_event_clauses(f)
+    event = models.SecurityEvent
+
+    if not chunk_size:
+        # 被删除的告警（如误报）不会在下一次 /auto-alarm-check 中重新产生
+        db.execute(alerts.suppress_statement(clauses))
+        result = db.execute(delete(event).where(*clauses), execution_options={"synchronize_session": False})
+        db.commit()
+        return schemas.BulkWriteResult(affected=result.rowcount, chunks=1)
+
+    def per_chunk(ids):
+        db.execute(alerts.suppress_statement([event.id.in_(ids)]))
+        return db.execute(
+            delete(event).where(event.id.in_(ids)),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+
+    return _run(db, event, clauses, chunk_size, per_chunk)
@@ -0,0 +1,108 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+import serialization
+
+# 分析结果缓存：TTL + 容量上限的 LRU，写接口按表名标签失效
+CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_SIZE", "256"))
+
+
+class CacheEntry:
+    def __init__(self, body: bytes, tags: frozenset, expires_at: float):
+        self.body = body
+        self.tags = tags
+        self.expires_at = expires_at
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+    def response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if self.etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+        return Response(self.body, media_type="application/json", headers=headers)
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 每次失效递增；计算期间发生过失效的结果不写入缓存
+        self.generation = 0
+
+    def get(self, key) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, body: bytes, tags: Iterable[str], generation: Optional[int] = None) -> CacheEntry:
+        entry = CacheEntry(body, frozenset(tags), time.monotonic() + self.ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, *tags: str):
+        """删除依赖任一给定表的缓存项"""
+        tags = set(tags)
+        with self._lock:
+            self.generation += 1
+            for key in [k for k, entry in self._entries.items() if entry.tags & tags]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+result_cache = ResultCache()
+# 其他进程内派生数据（如区间索引）按标签注册的失效回调
+_listeners = {}
+
+
+def on_invalidate(tag: str, callback):
+    _listeners.setdefault(tag, []).append(callback)
+
+
+def invalidate(*tags: str):
+    result_cache.invalidate(*tags)
+    for tag in tags:
+        for callback in _listeners.get(tag, ()):
+            callback()
+
+
+def cached(*tags: str):
+    """缓存接口的 JSON 结果并支持 ETag/If-None-Match；被装饰的接口需声明 request: Request 参数"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            request = kwargs["request"]
+            key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+            entry = result_cache.get(key)
+            if entry is None:
+                generation = result_cache.generation
+                body = serialization.dumps(fn(*args, **kwargs))
+                entry = result_cache.set(key, body, tags, generation)
+            return entry.response(request)
+        return wrapper
+    return decorator
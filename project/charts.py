@@ -0,0 +1,162 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models, analysis, refdata, serialization, cache, chart_render
+from chart_render import CHARTS, FORMATS
+
+# 图表在独立进程中用 Agg 后端渲染；CHART_WORKERS=0 时在请求线程中渲染（只使用面向对象接口，不经过 pyplot）
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", "2"))
+# 渲染结果按 (图表, 格式, 数据哈希) 缓存，数据不变时重复加载不再渲染
+CHART_CACHE_SIZE = int(os.environ.get("CHART_CACHE_SIZE", "64"))
+
+
+# ------------------ 图表数据（在请求进程中聚合） ------------------ #
+def hourly_heatmap_data(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        device_id: Optional[int] = None) -> dict:
+    """设备 × 24 小时的使用次数矩阵，口径与 /analysis/device-usage (rollup) 一致"""
+    _, hourly = analysis.device_usage_counts_rollup(db, analysis.rollup_filters(start, end, device_id))
+    names = refdata.get(db).device_names
+    matrix = {}
+    for dev_id, hour, count in hourly:
+        row = matrix.setdefault(names.get(dev_id, "Unknown"), [0] * 24)
+        row[int(hour)] += int(count)
+    devices = sorted(matrix)
+    return {"devices": devices, "counts": [matrix[device] for device in devices]}
+
+
+def area_scatter_data(db: Session) -> dict:
+    """每个用户的 (面积, 使用次数) 与异常用户，规则与 /analysis/area-vs-usage 一致"""
+    user_ids, areas, usages = analysis.user_area_usage_arrays(db)
+    if not len(user_ids):
+        return {"areas": [], "usages": [], "outliers": [], "avg_area": None, "avg_usage": None}
+    stats = analysis.area_vs_usage_stats(user_ids, areas, usages, include_raw=False)
+    return {
+        "areas": areas.tolist(),
+        "usages": usages.tolist(),
+        "outliers": [[row["user_id"], row["house_area"], row["usage_count"]] for row in stats["outliers"]],
+        "avg_area": stats["summary"]["avg_area"],
+        "avg_usage": stats["summary"]["avg_usage"],
+    }
+
+
+def abnormal_events_data(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """关联了使用记录的安防事件按设备类型计数（原始记录已清理的计为 Unknown）"""
+    event, log, device = models.SecurityEvent, models.UsageLog, models.Device
+    device_type = func.coalesce(device.type, "Unknown")
+    stmt = (
+        select(device_type, func.count())
+        .select_from(event)
+        .outerjoin(log, log.id == event.usage_log_id)
+        .outerjoin(device, device.id == log.device_id)
+        .where(event.usage_log_id.is_not(None))
+        .group_by(device_type)
+        .order_by(func.count().desc(), device_type)
+    )
+    if start is not None:
+        stmt = stmt.where(event.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(event.timestamp <= end)
+    rows = db.execute(stmt).all()
+    return {"types": [row[0] for row in rows], "counts": [int(row[1]) for row in rows]}
+
+
+# 图表数据依赖的表，写接口按标签使缓存的数据失效
+CHART_TAGS = {
+    "hourly-heatmap": ("usage_logs", "devices"),
+    "area-scatter": ("usage_logs", "users"),
+    "abnormal-events": ("security_events", "usage_logs", "devices"),
+}
+
+
+def chart_data(db: Session, chart: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+               device_id: Optional[int] = None) -> bytes:
+    """图表数据的 JSON，与分析接口共用结果缓存"""
+    key = ("chart-data", chart, start, end, device_id)
+    entry = cache.result_cache.get(key)
+    if entry is None:
+        generation = cache.result_cache.generation
+        if chart == "hourly-heatmap":
+            data = hourly_heatmap_data(db, start, end, device_id)
+        elif chart == "area-scatter":
+            data = area_scatter_data(db)
+        else:
+            data = abnormal_events_data(db, start, end)
+        entry = cache.result_cache.set(key, serialization.dumps(data), CHART_TAGS[chart], generation)
+    return entry.body
+
+
+# ------------------ 缓存与进程池 ------------------ #
+def digest(chart: str, fmt: str, body: bytes) -> str:
+    """图像缓存的键，同时用作 ETag：由图表数据决定，无需渲染即可得到"""
+    return hashlib.sha256(f"{chart}:{fmt}:".encode() + body).hexdigest()
+
+
+class ChartRenderer:
+    def __init__(self, workers: int = CHART_WORKERS, max_entries: int = CHART_CACHE_SIZE):
+        self.workers = workers
+        self.max_entries = max_entries
+        self._pool = None
+        self._lock = threading.Lock()
+        self._images = OrderedDict()  # key -> bytes
+        self._pending = {}  # key -> Future，同一图表的并发请求只渲染一次
+
+    def _executor(self):
+        if self._pool is None:
+            # 不能在多线程的服务进程中直接 fork（连接池、后台线程持有的锁会被复制）；
+            # forkserver 的服务进程只预先导入 chart_render，工作进程由它 fork 出来
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if context.get_start_method() == "forkserver":
+                context.set_forkserver_preload(["chart_render"])
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=chart_render.init_worker)
+        return self._pool
+
+    def get(self, chart: str, fmt: str, body: bytes) -> Tuple[bytes, str]:
+        """按图表数据 (JSON) 渲染，返回 (图像, 数据哈希)"""
+        key = digest(chart, fmt, body)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                return image, key
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future() if self.workers <= 0 else self._executor().submit(chart_render.render, chart, fmt, body)
+                self._pending[key] = future
+        if owner and self.workers <= 0:
+            chart_render.init_worker()
+            try:
+                future.set_result(chart_render.render(chart, fmt, body))
+            except Exception as e:
+                future.set_exception(e)
+        try:
+            image = future.result()
+        except BrokenProcessPool:
+            # 工作进程异常退出后重建进程池，下一次请求重新渲染
+            with self._lock:
+                self._pool = None
+            raise
+        finally:
+            if owner:
+                with self._lock:
+                    self._pending.pop(key, None)
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+        return image, key
+
+
+renderer = ChartRenderer()
@@ -0,0 +1,47 @@
+import heapq
+from collections import Counter
+from typing import List, Tuple
+
+# 只依赖标准库：进程池的工作进程导入本模块时不会加载应用、数据库连接或缓存
+
+# 单条使用记录: (device_id, start_time, finish_time)
+Interval = Tuple[int, object, object]
+
+
+# ------------------ 设备同时使用（可在工作进程中执行） ------------------ #
+def cousage_pairs_pairwise(logs: List[Interval]) -> Counter:
+    """原始 O(n²) 两两比较实现，作为正确性对照"""
+    logs = sorted(logs, key=lambda x: x[1])
+    pairs = Counter()
+    n = len(logs)
+    for i in range(n):
+        for j in range(i + 1, n):
+            d1, s1, f1 = logs[i]
+            d2, s2, f2 = logs[j]
+            if f1 >= s2 and f2 >= s1:
+                pairs[(d1, d2)] += 1
+    return pairs
+
+
+def cousage_pairs_sweep(logs: List[Interval]) -> Counter:
+    """扫描线 + 活动集，O(n log n + k) 统计同一用户下时间重叠的设备对"""
+    logs = sorted(logs, key=lambda x: x[1])
+    pairs = Counter()
+    active = []  # 最小堆: (finish_time, seq, device_id, start_time)
+    for seq, (device_id, start, finish) in enumerate(logs):
+        # 结束时间早于当前开始时间的记录不可能再与后续记录重叠
+        while active and active[0][0] < start:
+            heapq.heappop(active)
+        for other_finish, _, other_device, other_start in active:
+            if finish >= other_start:
+                pairs[(other_device, device_id)] += 1
+        heapq.heappush(active, (finish, seq, device_id, start))
+    return pairs
+
+
+def cousage_pairs_batch(batch: List[List[Interval]]) -> Counter:
+    """一批用户的记录（每个用户一个列表）合计的设备对"""
+    pairs = Counter()
+    for logs in batch:
+        pairs.update(cousage_pairs_sweep(logs))
+    return pairs
@@ -1,4 +1,46 @@
-from database import engine, Base
-import models
+import argparse
+
+from sqlalchemy import inspect, select, text
+
+from database import engine, Base, SessionLocal
+import models, partitioning, rollups, retention
+
+parser = argparse.ArgumentParser(description="创建数据表；可选把 usage_logs / security_events 迁移为按月分区表")
+parser.add_argument("--partition", action="store_true", help="迁移为按月 RANGE 分区（仅 PostgreSQL）")
+parser.add_argument("--maintain-partitions", action="store_true", help="为已分区的表预建未来的月分区")
+parser.add_argument("--months-ahead", type=int, default=3)
+parser.add_argument("--drop-legacy", action="store_true", help="迁移完成后删除旧表 <table>_legacy")
+args = parser.parse_args()
 
 Base.metadata.create_all(bind=engine)
+
+# create_all 不会修改已存在的表：补上新增的（可空）列与索引
+inspector = inspect(engine)
+with engine.begin() as conn:
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                ))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+# usage_hourly_rollups 刚创建（或从未回填）而已有使用记录时，从 usage_logs 回填；
+# 否则按 rollup 统计的接口（/analysis/device-usage、/analysis/area-vs-usage、/charts）返回空结果
+with SessionLocal() as db:
+    if db.scalar(select(models.UsageHourlyRollup.hour).limit(1)) is None \
+            and db.scalar(select(models.UsageLog.id).limit(1)) is not None:
+        print("usage_hourly_rollups is empty: backfilling from usage_logs")
+        rollups.rebuild(db, retention.get_cutoff(db))
+
+if args.partition or args.maintain_partitions:
+    if engine.dialect.name != "postgresql":
+        parser.error("partitioning requires PostgreSQL")
+    with engine.begin() as conn:
+        if args.partition:
+            for table in partitioning.PARTITIONED_TABLES:
+                partitioning.migrate_to_partitioned(conn, table, args.months_ahead, args.drop_legacy)
+        else:
+            partitioning.maintain(conn, args.months_ahead)
@@ -0,0 +1,209 @@
+import argparse
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+# 每个 RecordBatch 的最大行数
+BATCH_ROWS = 65536
+DEFAULT_CHUNK_DAYS = 7
+FORMATS = {"arrow": "application/vnd.apache.arrow.stream", "parquet": "application/vnd.apache.parquet"}
+
+
+def _usage_logs():
+    log = models.UsageLog
+    return select(log.id, log.user_id, log.device_id, log.start_time, log.finish_time), log.start_time
+
+
+def _security_events():
+    event, log, device = models.SecurityEvent, models.UsageLog, models.Device
+    query = (
+        select(event.id, event.user_id, event.usage_log_id, device.type.label("device_type"),
+               event.event, event.severity, event.timestamp)
+        .outerjoin(log, log.id == event.usage_log_id)
+        .outerjoin(device, device.id == log.device_id)
+    )
+    return query, event.timestamp
+
+
+def _device_usage_hourly():
+    rollup, device = models.UsageHourlyRollup, models.Device
+    query = (
+        select(rollup.device_id, device.name.label("device_name"), rollup.user_id, rollup.hour,
+               rollup.end_hour, rollup.session_count, rollup.total_duration)
+        .outerjoin(device, device.id == rollup.device_id)
+        .where(rollup.session_count > 0)
+    )
+    return query, rollup.hour
+
+
+def _area_usage():
+    user, rollup = models.User, models.UsageHourlyRollup
+    usage = func.sum(rollup.session_count)
+    query = (
+        select(user.id.label("user_id"), user.house_area, usage.label("usage_count"))
+        .join(rollup, rollup.user_id == user.id)
+        .where(user.house_area.is_not(None), user.house_area != 0)
+        .group_by(user.id, user.house_area)
+        .having(usage > 0)
+    )
+    return query, None
+
+
+# 数据集 -> (查询, 分片时间列, Arrow 字段)
+DATASETS = {
+    "usage_logs": (_usage_logs, [
+        ("id", "int64"), ("user_id", "int64"), ("device_id", "int64"),
+        ("start_time", "timestamp[us]"), ("finish_time", "timestamp[us]"),
+    ]),
+    "security_events": (_security_events, [
+        ("id", "int64"), ("user_id", "int64"), ("usage_log_id", "int64"), ("device_type", "string"),
+        ("event", "string"), ("severity", "string"), ("timestamp", "timestamp[us]"),
+    ]),
+    "device_usage_hourly": (_device_usage_hourly, [
+        ("device_id", "int64"), ("device_name", "string"), ("user_id", "int64"), ("hour", "timestamp[us]"),
+        ("end_hour", "int64"), ("session_count", "int64"), ("total_duration", "float64"),
+    ]),
+    "area_usage": (_area_usage, [
+        ("user_id", "int64"), ("house_area", "float64"), ("usage_count", "int64"),
+    ]),
+}
+
+
+def arrow_schema(dataset: str):
+    import pyarrow as pa
+
+    return pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in DATASETS[dataset][1]])
+
+
+def iter_record_batches(db: Session, dataset: str, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None, chunk_days: int = DEFAULT_CHUNK_DAYS) -> Iterator:
+    """按时间窗口分片查询，每片再按 BATCH_ROWS 行切成 RecordBatch"""
+    import pyarrow as pa
+
+    query_fn, _ = DATASETS[dataset]
+    query, time_column = query_fn()
+    schema = arrow_schema(dataset)
+
+    def batches(stmt):
+        result = db.execute(stmt.execution_options(yield_per=BATCH_ROWS))
+        for rows in result.partitions():
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+            )
+
+    if time_column is None:
+        yield from batches(query)
+        return
+
+    if start is None or end is None:
+        first, last = db.execute(select(func.min(time_column), func.max(time_column))).one()
+        if first is None:
+            return
+        start = start or first
+        end = end or last + timedelta(microseconds=1)
+
+    window = timedelta(days=chunk_days)
+    lower = start
+    while lower < end:
+        upper = min(lower + window, end)
+        yield from batches(query.where(time_column >= lower, time_column < upper).order_by(time_column))
+        lower = upper
+
+
+class _ChunkSink:
+    """给 pyarrow 写入用的只追加缓冲，写完一批后由调用方取走字节"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def encode(batches, dataset: str, fmt: str) -> Iterator[bytes]:
+    """把 RecordBatch 流编码为 Arrow IPC stream 或 Parquet，边写边产出字节"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    schema = arrow_schema(dataset)
+    if fmt == "arrow":
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+    else:
+        writer = pq.ParquetWriter(sink, schema)
+        write = lambda batch: writer.write_batch(batch)  # 每个 batch 一个 row group
+    for batch in batches:
+        write(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def streaming_response(dataset: str, fmt: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       chunk_days: int = DEFAULT_CHUNK_DAYS) -> StreamingResponse:
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail="Unknown dataset")
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=503, detail="pyarrow is not installed")
+
+    def generate():
+        # 流式响应的生命周期长于请求依赖，单独持有会话
+        db = SessionLocal()
+        try:
+            yield from encode(iter_record_batches(db, dataset, start, end, chunk_days), dataset, fmt)
+        finally:
+            db.close()
+
+    filename = f"{dataset}.{fmt}"
+    return StreamingResponse(generate(), media_type=FORMATS[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+if __name__ == "__main__":
+    # python export.py usage_logs usage_logs.parquet --start 2024-01-01 --end 2024-02-01
+    parser = argparse.ArgumentParser(description="导出数据集为 Arrow IPC / Parquet")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("output", help="输出文件，扩展名 .arrow 或 .parquet")
+    parser.add_argument("--start", type=datetime.fromisoformat)
+    parser.add_argument("--end", type=datetime.fromisoformat)
+    parser.add_argument("--chunk-days", type=int, default=DEFAULT_CHUNK_DAYS)
+    args = parser.parse_args()
+
+    fmt = "parquet" if args.output.endswith(".parquet") else "arrow"
+    db = SessionLocal()
+    try:
+        with open(args.output, "wb") as f:
+            for data in encode(iter_record_batches(db, args.dataset, args.start, args.end, args.chunk_days),
+                               args.dataset, fmt):
+                f.write(data)
+    finally:
+        db.close()
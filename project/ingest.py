@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Iterable, List, Tuple
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+import models, schemas, rollups, alerts, intervals
+
+# 每批写入的行数
+DEFAULT_CHUNK_SIZE = 1000
+USAGE_LOG_COLUMNS = ("user_id", "device_id", "start_time", "finish_time")
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+
+
+def validate_chunk(items: Iterable[Tuple[int, Any]]) -> Tuple[List[Tuple[int, dict]], List[schemas.BulkRowError]]:
+    """逐行校验一批原始数据，返回 (合法行, 错误列表)"""
+    rows, errors = [], []
+    for index, item in items:
+        if isinstance(item, schemas.BulkRowError):
+            errors.append(item)
+            continue
+        try:
+            rows.append((index, schemas.UsageLogCreate.model_validate(item).model_dump()))
+        except ValidationError as e:
+            errors.append(schemas.BulkRowError(
+                index=index,
+                errors=[f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in e.errors()],
+            ))
+    return rows, errors
+
+
+def check_references(db: Session, rows: List[Tuple[int, dict]]):
+    """一次查询校验整批的外键，避免单行失败导致整批回滚"""
+    user_ids = {row["user_id"] for _, row in rows}
+    device_ids = {row["device_id"] for _, row in rows}
+    known_users = set(db.scalars(select(models.User.id).where(models.User.id.in_(user_ids)))) if user_ids else set()
+    known_devices = set(db.scalars(select(models.Device.id).where(models.Device.id.in_(device_ids)))) if device_ids else set()
+
+    valid, errors = [], []
+    for index, row in rows:
+        problems = []
+        if row["user_id"] not in known_users:
+            problems.append(f"user_id: User {row['user_id']} not found")
+        if row["device_id"] not in known_devices:
+            problems.append(f"device_id: Device {row['device_id']} not found")
+        if problems:
+            errors.append(schemas.BulkRowError(index=index, errors=problems))
+        else:
+            valid.append(row)
+    return valid, errors
+
+
+def copy_usage_logs(db: Session, rows: List[dict]):
+    """PostgreSQL COPY 写入，与 Session 共用同一事务"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([row[col].isoformat() if hasattr(row[col], "isoformat") else row[col]
+                         for col in USAGE_LOG_COLUMNS])
+    buf.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {models.UsageLog.__tablename__} ({', '.join(USAGE_LOG_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buf,
+        )
+    finally:
+        cursor.close()
+
+
+def insert_usage_logs(db: Session, rows: List[dict]) -> Tuple[List[int], list]:
+    """一条多行 INSERT 写入已校验的使用记录，即时告警并维护 rollup；返回 (新 id, 命中的告警)，由调用方提交"""
+    result = db.execute(insert(models.UsageLog).returning(models.UsageLog.id, sort_by_parameter_order=True), rows)
+    ids = result.scalars().all()
+    intervals.stage(db, [(log_id, rollups.log_row_from_dict(row)) for log_id, row in zip(ids, rows)])
+    flagged = alerts.check_new_logs(db, [(log_id, *rollups.log_row_from_dict(row)) for log_id, row in zip(ids, rows)])
+    rollups.apply(db, (rollups.log_row_from_dict(row) for row in rows))
+    return ids, flagged
+
+
+def write_chunk(db: Session, items: List[Tuple[int, Any]], method: str = "insert") -> Tuple[int, List[schemas.BulkRowError]]:
+    """校验并写入一批使用记录：一条多行 INSERT（或 COPY），一次提交"""
+    rows, errors = validate_chunk(items)
+    rows, ref_errors = check_references(db, rows)
+    errors.extend(ref_errors)
+
+    if rows:
+        if method == "copy" and db.get_bind().dialect.name == "postgresql":
+            # COPY 拿不到新 id，告警交由 /auto-alarm-check 批量检查
+            copy_usage_logs(db, rows)
+            intervals.stage_rebuild(db)
+            rollups.apply(db, (rollups.log_row_from_dict(row) for row in rows))
+            flagged = []
+        else:
+            _, flagged = insert_usage_logs(db, rows)
+        db.commit()
+        alerts.publish(flagged)
+    return len(rows), errors
+
+
+def parse_ndjson_line(index: int, line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return schemas.BulkRowError(index=index, errors=[f"row: invalid JSON ({e})"])
+
+
+async def iter_request_rows(request: Request) -> AsyncIterator[Tuple[int, Any]]:
+    """按行产出请求体中的记录：NDJSON 边接收边解析，其余按 JSON 数组处理"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(NDJSON_CONTENT_TYPES):
+        index, pending = 0, b""
+        async for data in request.stream():
+            pending += data
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, parse_ndjson_line(index, line)
+                    index += 1
+        if pending.strip():
+            yield index, parse_ndjson_line(index, pending)
+        return
+
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of usage logs")
+    for index, item in enumerate(payload):
+        yield index, item
@@ -0,0 +1,394 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, NamedTuple, Optional
+
+from sqlalchemy import event, func, literal_column, select
+from sqlalchemy.orm import Session, object_session
+
+import models, refdata
+
+# auto: PostgreSQL 使用 ix_usage_logs_active_range (GiST)，其他数据库使用进程内区间索引
+INTERVAL_BACKEND = os.environ.get("INTERVAL_INDEX", "auto")
+# 进程内索引最长复用时间：本进程的写入提交后增量生效，这里兜底其他进程的写入
+INDEX_TTL_SECONDS = float(os.environ.get("INTERVAL_INDEX_TTL", "60"))
+BLOCK_SIZE = 64
+LOAD_BATCH_SIZE = 100000
+
+
+class IntervalIndex:
+    """按开始时间排序的区间，每 BLOCK_SIZE 条一块，块内最大结束时间建成线段树
+
+    查询 [lo, hi] 时，开始时间 <= hi 的记录是排序后的一个前缀（二分查找）；
+    线段树剪掉最大结束时间 < lo 的块，复杂度 O(log n + 命中块数)。
+    时间均为微秒整数，结束时间为空视为仍在使用。
+    """
+
+    def __init__(self, ids, user_ids, device_ids, starts, finishes):
+        import numpy as np
+
+        order = np.argsort(starts, kind="stable")
+        self.ids = ids[order]
+        self.user_ids = user_ids[order]
+        self.device_ids = device_ids[order]
+        self.starts = starts[order]
+        self.finishes = finishes[order]
+
+        n = len(order)
+        self.blocks = -(-n // BLOCK_SIZE)
+        self.size = 1
+        while self.size < self.blocks:
+            self.size *= 2
+        lowest = np.iinfo(np.int64).min
+        self.tree = np.full(2 * self.size, lowest, dtype=np.int64)
+        if n:
+            padded = np.full(self.blocks * BLOCK_SIZE, lowest, dtype=np.int64)
+            padded[:n] = self.finishes
+            self.tree[self.size:self.size + self.blocks] = padded.reshape(self.blocks, BLOCK_SIZE).max(axis=1)
+        level = self.size
+        while level > 1:
+            self.tree[level // 2:level] = np.maximum(self.tree[level:2 * level:2], self.tree[level + 1:2 * level:2])
+            level //= 2
+
+    def __len__(self):
+        return len(self.ids)
+
+    def query(self, lo: int, hi: int):
+        """返回与 [lo, hi] 重叠的记录位置（按开始时间升序）"""
+        import numpy as np
+
+        end = int(np.searchsorted(self.starts, hi, side="right"))
+        if end == 0:
+            return np.empty(0, dtype=np.int64)
+        last_block = (end - 1) // BLOCK_SIZE
+
+        hits = []
+        stack = [(1, 0, self.size)]
+        while stack:
+            node, left, right = stack.pop()
+            if left > last_block or self.tree[node] < lo:
+                continue
+            if right - left == 1:
+                hits.append(left)
+                continue
+            mid = (left + right) // 2
+            stack.append((2 * node + 1, mid, right))
+            stack.append((2 * node, left, mid))
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+
+        positions = (np.asarray(hits, dtype=np.int64)[:, None] * BLOCK_SIZE + np.arange(BLOCK_SIZE)).ravel()
+        positions = positions[positions < end]
+        return positions[self.finishes[positions] >= lo]
+
+
+def _micros(values):
+    import numpy as np
+
+    return np.asarray(values, dtype="datetime64[us]").astype(np.int64)
+
+
+def build_index(db: Session) -> IntervalIndex:
+    import numpy as np
+
+    log = models.UsageLog
+    stmt = (
+        select(log.id, log.user_id, log.device_id, log.start_time, log.finish_time)
+        .where(log.start_time.is_not(None))
+        .execution_options(yield_per=LOAD_BATCH_SIZE)
+    )
+    open_end = np.iinfo(np.int64).max
+    parts = []
+    for rows in db.execute(stmt).partitions():
+        ids, user_ids, device_ids, starts, finishes = zip(*rows)
+        finish_dates = np.asarray([f if f is not None else "NaT" for f in finishes], dtype="datetime64[us]")
+        finish_values = finish_dates.astype(np.int64)
+        finish_values[np.isnat(finish_dates)] = open_end
+        parts.append((
+            np.asarray(ids, dtype=np.int64),
+            np.asarray([u if u is not None else -1 for u in user_ids], dtype=np.int64),
+            np.asarray([d if d is not None else -1 for d in device_ids], dtype=np.int64),
+            _micros(starts),
+            finish_values,
+        ))
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return IntervalIndex(empty, empty, empty, empty, empty)
+    return IntervalIndex(*(np.concatenate(column) for column in zip(*parts)))
+
+
+# ------------------ 增量维护 ------------------ #
+# 一条变更：(id, (user_id, device_id, start_time, finish_time))；行为 None 表示删除
+_STAGED = "interval_index_changes"
+_REBUILD = object()
+# 变更先放在覆盖层中（查询时线性扫描），超过 max(MERGE_MIN, 索引行数 / MERGE_RATIO) 条时在内存中合并进索引
+MERGE_MIN = 4096
+MERGE_RATIO = 32
+
+
+class _Overlay(NamedTuple):
+    """某一时刻的覆盖层：已从基础索引中移除的 id（含被修改的），以及新增 / 修改后的行"""
+    removed: Any
+    ids: Any
+    user_ids: Any
+    device_ids: Any
+    starts: Any
+    finishes: Any
+
+
+class IndexView(NamedTuple):
+    base: IntervalIndex
+    overlay: _Overlay
+
+    def base_removed(self):
+        import numpy as np
+
+        if not len(self.overlay.removed):
+            return np.zeros(len(self.base), dtype=bool)
+        return np.isin(self.base.ids, self.overlay.removed)
+
+    def overlapping(self, lo: int, hi: int):
+        """与 [lo, hi] 重叠的记录，返回 (ids, user_ids, device_ids, starts, finishes) 五列"""
+        import numpy as np
+
+        base, overlay = self.base, self.overlay
+        positions = base.query(lo, hi)
+        if len(overlay.removed) and len(positions):
+            positions = positions[~np.isin(base.ids[positions], overlay.removed)]
+        extra = np.flatnonzero((overlay.starts <= hi) & (overlay.finishes >= lo))
+        return tuple(
+            np.concatenate([column[positions], extra_column[extra]])
+            for column, extra_column in zip(
+                (base.ids, base.user_ids, base.device_ids, base.starts, base.finishes),
+                (overlay.ids, overlay.user_ids, overlay.device_ids, overlay.starts, overlay.finishes),
+            )
+        )
+
+
+def _index_row(row_id: int, row):
+    """变更转为索引中的整数列；开始时间为空的记录不进入索引"""
+    import numpy as np
+
+    if row is None or row[2] is None:
+        return None
+    user_id, device_id, start, finish = row
+    open_end = int(np.iinfo(np.int64).max)
+    return (row_id, -1 if user_id is None else user_id, -1 if device_id is None else device_id,
+            int(_micros([start])[0]), open_end if finish is None else int(_micros([finish])[0]))
+
+
+class _IndexHolder:
+    """基础索引 + 覆盖层：本进程的写入在提交后增量生效，无法确定变更内容时（COPY、其他进程、TTL）整体重建"""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # 保护基础索引与覆盖层
+        self._build_lock = threading.Lock()  # 同一时间只从数据库构建一次
+        self._index = None
+        self._added = {}  # id -> 索引行
+        self._removed = set()
+        self._view = None
+        self._replay = None  # 构建期间提交的变更，构建完成后重放
+        self._built_at = 0.0
+        self._stale = True
+
+    def invalidate(self):
+        self._stale = True
+
+    def apply(self, changes):
+        """应用已提交的变更；按 id 覆盖，重复应用结果不变"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(changes)
+            self._apply(changes)
+
+    def _apply(self, changes):
+        if self._index is not None:
+            for row_id, row in changes:
+                self._removed.add(row_id)
+                row = _index_row(row_id, row)
+                if row is None:
+                    self._added.pop(row_id, None)
+                else:
+                    self._added[row_id] = row
+            self._view = None
+            if len(self._added) + len(self._removed) > max(MERGE_MIN, len(self._index) // MERGE_RATIO):
+                self._merge()
+
+    def _merge(self):
+        """把覆盖层合并进基础索引（只在内存中重新排序，不访问数据库）"""
+        import numpy as np
+
+        view = self._current()
+        keep = ~view.base_removed()
+        base = self._index
+        self._index = IntervalIndex(*(
+            np.concatenate([column[keep], extra_column])
+            for column, extra_column in zip(
+                (base.ids, base.user_ids, base.device_ids, base.starts, base.finishes),
+                (view.overlay.ids, view.overlay.user_ids, view.overlay.device_ids,
+                 view.overlay.starts, view.overlay.finishes),
+            )
+        ))
+        self._added, self._removed, self._view = {}, set(), None
+
+    def _current(self) -> IndexView:
+        import numpy as np
+
+        if self._view is None:
+            rows = list(self._added.values())
+            columns = [np.asarray(column, dtype=np.int64) for column in zip(*rows)] if rows else \
+                [np.empty(0, dtype=np.int64)] * 5
+            removed = np.fromiter(self._removed, dtype=np.int64, count=len(self._removed))
+            self._view = IndexView(self._index, _Overlay(removed, *columns))
+        return self._view
+
+    def get(self, db: Session) -> IndexView:
+        if self._stale or self._index is None or time.monotonic() - self._built_at > INDEX_TTL_SECONDS:
+            with self._build_lock:
+                if self._stale or self._index is None or time.monotonic() - self._built_at > INDEX_TTL_SECONDS:
+                    self._rebuild(db)
+        with self._lock:
+            return self._current()
+
+    def _rebuild(self, db: Session):
+        # 先清除标记：构建期间再次失效时，下次查询重建；构建期间提交的增量变更在替换后重放
+        with self._lock:
+            self._stale = False
+            self._replay = []
+        try:
+            index = build_index(db)
+        except Exception:
+            with self._lock:
+                self._replay = None
+                self._stale = True
+            raise
+        with self._lock:
+            replay, self._replay = self._replay, None
+            self._index, self._added, self._removed, self._view = index, {}, set(), None
+            self._built_at = time.monotonic()
+            self._apply(replay)
+
+
+holder = _IndexHolder()
+
+
+def stage(db: Session, changes):
+    """记录当前事务中使用记录的变更 [(id, (user_id, device_id, start, finish) 或 None)]，提交后更新进程内索引"""
+    db.info.setdefault(_STAGED, []).extend(changes)
+
+
+def stage_rebuild(db: Session):
+    """变更内容无法逐条列出（如 COPY）时，提交后整体重建"""
+    db.info.setdefault(_STAGED, []).append(_REBUILD)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    changes = session.info.pop(_STAGED, None)
+    if not changes:
+        return
+    if any(change is _REBUILD for change in changes):
+        holder.invalidate()
+    else:
+        holder.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop(_STAGED, None)
+
+
+# ORM 写入（同步与异步 CRUD 接口）自动记录变更；Core 语句由调用方调用 stage
+@event.listens_for(models.UsageLog, "after_insert")
+@event.listens_for(models.UsageLog, "after_update")
+def _orm_saved(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        stage(session, [(target.id, (target.user_id, target.device_id, target.start_time, target.finish_time))])
+
+
+@event.listens_for(models.UsageLog, "after_delete")
+def _orm_deleted(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        stage(session, [(target.id, None)])
+
+
+def _use_gist(db: Session) -> bool:
+    if INTERVAL_BACKEND == "auto":
+        return db.get_bind().dialect.name == "postgresql"
+    return INTERVAL_BACKEND == "postgresql"
+
+
+def active_usage(db: Session, start: datetime, end: datetime, user_id: Optional[int] = None,
+                 device_id: Optional[int] = None, device_type: Optional[str] = None, limit: int = 100):
+    """与 [start, end] 重叠的使用记录：返回 (按用户与设备汇总的 [(user_id, device_id, 次数)], 前 limit 条记录)"""
+    device_ids = None
+    if device_type is not None:
+        device_ids = refdata.get(db).devices_by_type.get(device_type, ())
+    if _use_gist(db):
+        return _active_usage_gist(db, start, end, user_id, device_id, device_ids, limit)
+    return _active_usage_memory(db, start, end, user_id, device_id, device_ids, limit)
+
+
+def _active_usage_gist(db, start, end, user_id, device_id, device_ids, limit):
+    log = models.UsageLog
+    # 与索引表达式完全一致，才能使用 ix_usage_logs_active_range
+    bounds = literal_column("'[]'")
+    clauses = [
+        func.tsrange(func.least(log.start_time, log.finish_time), log.finish_time, bounds)
+        .op("&&")(func.tsrange(start, end, bounds)),
+        log.start_time.is_not(None),
+    ]
+    if user_id is not None:
+        clauses.append(log.user_id == user_id)
+    if device_id is not None:
+        clauses.append(log.device_id == device_id)
+    if device_ids is not None:
+        clauses.append(log.device_id.in_(device_ids))
+
+    groups = db.execute(
+        select(log.user_id, log.device_id, func.count()).where(*clauses)
+        .group_by(log.user_id, log.device_id).order_by(log.user_id, log.device_id)
+    ).all()
+    sessions = db.execute(
+        select(log.id, log.user_id, log.device_id, log.start_time, log.finish_time)
+        .where(*clauses).order_by(log.start_time, log.id).limit(limit)
+    ).all()
+    return [tuple(row) for row in groups], [tuple(row) for row in sessions]
+
+
+def _nullable(value: int) -> Optional[int]:
+    # 载入索引时空的 user_id / device_id 记为 -1
+    return None if value < 0 else value
+
+
+def _active_usage_memory(db, start, end, user_id, device_id, device_ids, limit):
+    import numpy as np
+
+    columns = holder.get(db).overlapping(int(_micros([start])[0]), int(_micros([end])[0]))
+    mask = np.ones(len(columns[0]), dtype=bool)
+    if user_id is not None:
+        mask &= columns[1] == user_id
+    if device_id is not None:
+        mask &= columns[2] == device_id
+    if device_ids is not None:
+        mask &= np.isin(columns[2], np.asarray(device_ids, dtype=np.int64))
+    ids, users, devices, starts, finishes = (column[mask] for column in columns)
+
+    pairs, counts = np.unique(
+        np.stack([users, devices], axis=1), axis=0, return_counts=True
+    ) if len(ids) else (np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64))
+    groups = [(_nullable(u), _nullable(d), n) for (u, d), n in zip(pairs.tolist(), counts.tolist())]
+
+    # 同一开始时间按 id 排序，与 SQL 路径一致
+    top = np.lexsort((ids, starts))[:limit]
+    open_end = np.iinfo(np.int64).max
+    sessions = [
+        (int(ids[p]), _nullable(int(users[p])), _nullable(int(devices[p])),
+         starts[p].astype("datetime64[us]").item(),
+         None if finishes[p] == open_end else finishes[p].astype("datetime64[us]").item())
+        for p in top.tolist()
+    ]
+    return groups, sessions
@@ -1,21 +1,32 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import exists, inspect
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
-import models, schemas
-from typing import List
-import matplotlib.pyplot as plt
-import seaborn as sns
-import io
-import base64
-from collections import defaultdict
-import numpy as np
-from scipy.stats import pearsonr
-from typing import Dict, Any, List
+from database import SessionLocal, AsyncSessionLocal, engine
+import models, schemas, ingest, analysis, pagination, rollups, cache, alerts, alarm_rules, export, bulk, retention, metrics, intervals, writebehind, refdata, search, charts
+from typing import Dict, Any, List, Optional
 from datetime import datetime
+from itertools import groupby
+import asyncio
+import json
 
 # 创建数据库表
 models.Base.metadata.create_all(bind=engine)
 
+# create_all 不会给已存在的表加列：升级后缺列时直接停止，而不是在请求中报错
+def _missing_columns():
+    inspector = inspect(engine)
+    missing = []
+    for table in models.Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in existing)
+    return missing
+
+_missing = _missing_columns()
+if _missing:
+    raise RuntimeError(f"数据库缺少列 {', '.join(_missing)}：请先运行 python create_tables.py 升级表结构")
+
 app = FastAPI()
 
 def get_db():
@@ -25,18 +36,24 @@ def get_db():
     finally:
         db.close()
 
+# 设置 DB_ASYNC=1 时启用 /async 下的异步 CRUD 接口
+if AsyncSessionLocal is not None:
+    import async_crud
+    app.include_router(async_crud.router)
+
 # ------------------ 用户 CRUD ------------------ #
 @app.post("/users", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db_user = models.User(**user.dict())
     db.add(db_user)
     db.commit()
+    cache.invalidate("users")
     db.refresh(db_user)
     return db_user
 
 @app.get("/users", response_model=List[schemas.User])
-def list_users(db: Session = Depends(get_db)):
-    return db.query(models.User).all()
+def list_users(page: pagination.PageParams = Depends(), db: Session = Depends(get_db)):
+    return pagination.list_rows(db, models.User, schemas.User, page)
 
 @app.put("/users/{user_id}", response_model=schemas.User)
 def update_user(user_id: int, updated: schemas.UserCreate, db: Session = Depends(get_db)):
@@ -46,6 +63,7 @@ def update_user(user_id: int, updated: schemas.UserCreate, db: Session = Depends
     for key, value in updated.dict().items():
         setattr(user, key, value)
     db.commit()
+    cache.invalidate("users")
     return user
 
 @app.delete("/users/{user_id}")
@@ -55,6 +73,7 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
     db.delete(user)
     db.commit()
+    cache.invalidate("users")
     return {"detail": "User deleted"}
 
 # ------------------ 设备 CRUD ------------------ #
@@ -63,12 +82,13 @@ def create_device(device: schemas.DeviceCreate, db: Session = Depends(get_db)):
     db_device = models.Device(**device.dict())
     db.add(db_device)
     db.commit()
+    cache.invalidate("devices")
     db.refresh(db_device)
     return db_device
 
 @app.get("/devices", response_model=List[schemas.Device])
-def list_devices(db: Session = Depends(get_db)):
-    return db.query(models.Device).all()
+def list_devices(page: pagination.PageParams = Depends(), db: Session = Depends(get_db)):
+    return pagination.list_rows(db, models.Device, schemas.Device, page)
 
 @app.put("/devices/{device_id}", response_model=schemas.Device)
 def update_device(device_id: int, updated: schemas.DeviceCreate, db: Session = Depends(get_db)):
@@ -78,6 +98,7 @@ def update_device(device_id: int, updated: schemas.DeviceCreate, db: Session = D
     for key, value in updated.dict().items():
         setattr(device, key, value)
     db.commit()
+    cache.invalidate("devices")
     return device
 
 @app.delete("/devices/{device_id}")
@@ -87,29 +108,129 @@ def delete_device(device_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Device not found")
     db.delete(device)
     db.commit()
+    cache.invalidate("devices")
     return {"detail": "Device deleted"}
 
 # ------------------ 使用记录 CRUD ------------------ #
 @app.post("/usagelogs", response_model=schemas.UsageLog)
 def create_usage_log(log: schemas.UsageLogCreate, db: Session = Depends(get_db)):
+    if writebehind.buffer is not None:
+        return writebehind.buffer.submit("usage_logs", log.model_dump())
     db_log = models.UsageLog(**log.dict())
     db.add(db_log)
+    rollups.apply(db, [rollups.log_row(db_log)])
+    db.flush()
+    flagged = alerts.check_new_logs(db, [(db_log.id, *rollups.log_row(db_log))])
     db.commit()
+    cache.invalidate("usage_logs")
+    alerts.publish(flagged)
     db.refresh(db_log)
     return db_log
 
+@app.post("/usagelogs/bulk", response_model=schemas.BulkIngestResult)
+async def bulk_create_usage_logs(
+    request: Request,
+    chunk_size: int = Query(ingest.DEFAULT_CHUNK_SIZE, ge=1, le=10000),
+    method: str = Query("insert", pattern="^(insert|copy)$"),
+    db: Session = Depends(get_db),
+):
+    # 支持 JSON 数组与 NDJSON 流，按批校验、按批写入，逐行报告错误
+    received, inserted = 0, 0
+    errors = []
+    chunk = []
+
+    async def flush():
+        nonlocal inserted
+        count, chunk_errors = await run_in_threadpool(ingest.write_chunk, db, chunk, method)
+        inserted += count
+        errors.extend(chunk_errors)
+        if count:
+            cache.invalidate("usage_logs")
+        chunk.clear()
+
+    async for index, item in ingest.iter_request_rows(request):
+        received += 1
+        chunk.append((index, item))
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+
+    return schemas.BulkIngestResult(received=received, inserted=inserted, failed=len(errors), errors=errors)
+
+@app.post("/usagelogs/bulk-update", response_model=schemas.BulkWriteResult)
+def bulk_update_usage_logs(
+    body: schemas.UsageLogBulkUpdate,
+    chunk_size: Optional[int] = Query(None, ge=1, le=bulk.MAX_CHUNK_SIZE),
+    db: Session = Depends(get_db),
+):
+    # 按 id 列表或过滤条件批量修改；指定 chunk_size 时每批单独提交
+    try:
+        return bulk.update_usage_logs(db, body, chunk_size)
+    finally:
+        # 分批提交时中途失败，已提交的批次同样需要失效缓存
+        cache.invalidate("usage_logs")
+
+@app.post("/usagelogs/bulk-delete", response_model=schemas.BulkWriteResult)
+def bulk_delete_usage_logs(
+    body: schemas.UsageLogFilter,
+    chunk_size: Optional[int] = Query(None, ge=1, le=bulk.MAX_CHUNK_SIZE),
+    db: Session = Depends(get_db),
+):
+    try:
+        return bulk.delete_usage_logs(db, body, chunk_size)
+    finally:
+        cache.invalidate("usage_logs")
+
 @app.get("/usagelogs", response_model=List[schemas.UsageLog])
-def list_usage_logs(db: Session = Depends(get_db)):
-    return db.query(models.UsageLog).all()
+def list_usage_logs(page: pagination.PageParams = Depends(), db: Session = Depends(get_db)):
+    return pagination.list_rows(db, models.UsageLog, schemas.UsageLog, page)
+
+@app.get("/usagelogs/active", response_model=schemas.ActiveUsage)
+def active_usage_logs(
+    at: Optional[datetime] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    device_id: Optional[int] = None,
+    device_type: Optional[str] = None,
+    limit: int = Query(100, ge=0, le=pagination.MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    # 某时刻 (at) 或某时段 (start ~ end) 内处于使用中的记录，按用户与设备汇总；两端均为闭区间
+    if at is not None:
+        start = end = at
+    if start is None or end is None:
+        raise HTTPException(status_code=422, detail="Either 'at' or both 'start' and 'end' are required")
+    if start > end:
+        raise HTTPException(status_code=422, detail="'start' must not be after 'end'")
+
+    groups, sessions = intervals.active_usage(db, start, end, user_id, device_id, device_type, limit)
+    ref = refdata.get(db, {user for user, _, _ in groups}, {device for _, device, _ in groups})
+    active = [
+        schemas.ActiveDevice(
+            user_id=user, user_name=ref.user_names.get(user), device_id=device,
+            device_name=ref.device_names.get(device), device_type=ref.device_types.get(device), sessions=count,
+        )
+        for user, device, count in groups
+    ]
+    return schemas.ActiveUsage(
+        start=start, end=end, total_sessions=sum(count for _, _, count in groups), active=active,
+        sessions=[schemas.ActiveSession(id=s[0], user_id=s[1], device_id=s[2], start_time=s[3], finish_time=s[4])
+                  for s in sessions],
+    )
 
 @app.put("/usagelogs/{log_id}", response_model=schemas.UsageLog)
 def update_usage_log(log_id: int, updated_log: schemas.UsageLogCreate, db: Session = Depends(get_db)):
     log = db.query(models.UsageLog).get(log_id)
     if not log:
         raise HTTPException(status_code=404, detail="Usage log not found")
+    old_row = rollups.log_row(log)
     for key, value in updated_log.dict().items():
         setattr(log, key, value)
+    rollups.replace(db, old_row, rollups.log_row(log))
     db.commit()
+    cache.invalidate("usage_logs")
     db.refresh(log)
     return log
 
@@ -118,22 +239,104 @@ def delete_usage_log(log_id: int, db: Session = Depends(get_db)):
     log = db.query(models.UsageLog).get(log_id)
     if not log:
         raise HTTPException(status_code=404, detail="Usage log not found")
+    rollups.apply(db, [rollups.log_row(log)], sign=-1)
     db.delete(log)
     db.commit()
+    cache.invalidate("usage_logs")
     return {"detail": "Usage log deleted"}
 
 # ------------------ 安防事件 CRUD ------------------ #
 @app.post("/securityevents", response_model=schemas.SecurityEvent)
 def create_event(event: schemas.SecurityEventCreate, db: Session = Depends(get_db)):
+    if writebehind.buffer is not None:
+        return writebehind.buffer.submit("security_events", event.model_dump())
     db_event = models.SecurityEvent(**event.dict())
     db.add(db_event)
     db.commit()
+    cache.invalidate("security_events")
     db.refresh(db_event)
     return db_event
 
 @app.get("/securityevents", response_model=List[schemas.SecurityEvent])
-def list_events(db: Session = Depends(get_db)):
-    return db.query(models.SecurityEvent).all()
+def list_events(page: pagination.PageParams = Depends(), db: Session = Depends(get_db)):
+    return pagination.list_rows(db, models.SecurityEvent, schemas.SecurityEvent, page)
+
+@app.post("/securityevents/bulk-update", response_model=schemas.BulkWriteResult)
+def bulk_update_events(
+    body: schemas.SecurityEventBulkUpdate,
+    chunk_size: Optional[int] = Query(None, ge=1, le=bulk.MAX_CHUNK_SIZE),
+    db: Session = Depends(get_db),
+):
+    try:
+        return bulk.update_security_events(db, body, chunk_size)
+    finally:
+        # 分批提交时中途失败，已提交的批次同样需要失效缓存
+        cache.invalidate("security_events")
+
+@app.post("/securityevents/bulk-delete", response_model=schemas.BulkWriteResult)
+def bulk_delete_events(
+    body: schemas.SecurityEventFilter,
+    chunk_size: Optional[int] = Query(None, ge=1, le=bulk.MAX_CHUNK_SIZE),
+    db: Session = Depends(get_db),
+):
+    # 例如清理误报：{"severity": "warning", "end": "2024-06-01T00:00:00"}
+    try:
+        return bulk.delete_security_events(db, body, chunk_size)
+    finally:
+        cache.invalidate("security_events")
+
+ALERT_KEEPALIVE_SECONDS = 15
+
+@app.get("/securityevents/stream")
+async def stream_events(request: Request):
+    # Server-Sent Events：新告警产生后立即推送
+    subscriber = alerts.broker.subscribe()
+
+    async def generate():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    payload = await asyncio.wait_for(subscriber.queue.get(), ALERT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                dropped = subscriber.take_dropped()
+                if dropped:
+                    yield f"event: dropped\ndata: {json.dumps({'count': dropped})}\n\n"
+                yield f"event: alert\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        finally:
+            alerts.broker.unsubscribe(subscriber)
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/ws/securityevents")
+async def websocket_events(websocket: WebSocket):
+    await websocket.accept()
+    subscriber = alerts.broker.subscribe()
+    # 同时监听客户端消息，以便在没有告警时也能及时发现断开
+    receiver = asyncio.ensure_future(websocket.receive())
+    try:
+        while True:
+            getter = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                if receiver.result()["type"] == "websocket.disconnect":
+                    getter.cancel()
+                    break
+                receiver = asyncio.ensure_future(websocket.receive())
+            if getter not in done:
+                getter.cancel()
+                continue
+            dropped = subscriber.take_dropped()
+            if dropped:
+                await websocket.send_json({"type": "dropped", "count": dropped})
+            await websocket.send_json({"type": "alert", "data": getter.result()})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        alerts.broker.unsubscribe(subscriber)
 
 @app.put("/securityevents/{event_id}", response_model=schemas.SecurityEvent)
 def update_event(event_id: int, updated: schemas.SecurityEventCreate, db: Session = Depends(get_db)):
@@ -143,6 +346,7 @@ def update_event(event_id: int, updated: schemas.SecurityEventCreate, db: Sessio
     for key, value in updated.dict().items():
         setattr(event, key, value)
     db.commit()
+    cache.invalidate("security_events")
     return event
 
 @app.delete("/securityevents/{event_id}")
@@ -152,6 +356,7 @@ def delete_event(event_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Security event not found")
     db.delete(event)
     db.commit()
+    cache.invalidate("security_events")
     return {"detail": "Security event deleted"}
 
 # ------------------ 用户反馈 CRUD ------------------ #
@@ -160,12 +365,28 @@ def create_feedback(fb: schemas.FeedbackCreate, db: Session = Depends(get_db)):
     db_fb = models.Feedback(**fb.dict())
     db.add(db_fb)
     db.commit()
+    cache.invalidate("feedbacks")
     db.refresh(db_fb)
     return db_fb
 
 @app.get("/feedbacks", response_model=List[schemas.Feedback])
-def list_feedbacks(db: Session = Depends(get_db)):
-    return db.query(models.Feedback).all()
+def list_feedbacks(page: pagination.PageParams = Depends(), db: Session = Depends(get_db)):
+    return pagination.list_rows(db, models.Feedback, schemas.Feedback, page)
+
+@app.get("/feedbacks/search", response_model=schemas.FeedbackSearchResult)
+def search_feedbacks(
+    q: str = Query(..., min_length=1, max_length=500),
+    user_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    order: str = Query("rank", pattern="^(rank|recent)$"),
+    limit: int = Query(20, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    # q: 关键词 (AND)、"短语"、-排除；下一页把 next_cursor 作为 cursor 传回
+    hits, next_cursor = search.search_feedbacks(db, q, user_id, start, end, order, limit, cursor)
+    return {"hits": [hit._asdict() for hit in hits], "next_cursor": next_cursor}
 
 @app.put("/feedbacks/{feedback_id}", response_model=schemas.Feedback)
 def update_feedback(feedback_id: int, updated: schemas.FeedbackCreate, db: Session = Depends(get_db)):
@@ -175,6 +396,7 @@ def update_feedback(feedback_id: int, updated: schemas.FeedbackCreate, db: Sessi
     for key, value in updated.dict().items():
         setattr(feedback, key, value)
     db.commit()
+    cache.invalidate("feedbacks")
     return feedback
 
 @app.delete("/feedbacks/{feedback_id}")
@@ -184,238 +406,257 @@ def delete_feedback(feedback_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Feedback not found")
     db.delete(feedback)
     db.commit()
+    cache.invalidate("feedbacks")
     return {"detail": "Feedback deleted"}
 
 # ------------------ 分析 API ------------------ #
 # ------------------ 设备使用频率及时间段分析接口 ------------------ #
 @app.get("/analysis/device-usage")
-def analyze_device_usage(db: Session = Depends(get_db)):
-    usage_logs = db.query(models.UsageLog).all()
-    devices = db.query(models.Device).all()
-    device_map = {device.id: device.name for device in devices}
-
-    daily_usage_freq = defaultdict(lambda: defaultdict(int))
-    hourly_distribution = defaultdict(lambda: defaultdict(int))
-
-    for log in usage_logs:
-        device_name = device_map.get(log.device_id, "Unknown")
-
-        if log.start_time:
-            day = log.start_time.date()
-            daily_usage_freq[device_name][str(day)] += 1
-
-        # 小时分布
-        if log.start_time and log.finish_time:
-            start_hour = log.start_time.hour
-            end_hour = log.finish_time.hour
-            for hour in range(start_hour, end_hour + 1):
-                hourly_distribution[device_name][hour] += 1
-
-    # 计算每天平均使用频率
-    average_daily_freq = {}
-    for device, day_counts in daily_usage_freq.items():
-        total_usage = sum(day_counts.values())
-        num_days = len(day_counts)
-        average = total_usage / num_days if num_days else 0
-        average_daily_freq[device] = round(average, 2)
-
-    result = {
-        "daily_usage_frequency": {
-            device: dict(date_counts) for device, date_counts in daily_usage_freq.items()
-        },
-        "average_daily_frequency": average_daily_freq,
-        "hourly_distribution": {
-            device: dict(hour_dist) for device, hour_dist in hourly_distribution.items()
-        }
-    }
+@cache.cached("usage_logs", "devices")
+def analyze_device_usage(
+    request: Request,
+    mode: str = Query("rollup", pattern="^(rollup|sql|python)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    device_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    # rollup: 读取预聚合表（时间窗口按整点生效）；sql: 在数据库中聚合原始记录；python: 逐行统计（对照实现）
+    # 已压缩的历史部分在 sql / python 模式下同样从 rollup 读取
+    device_map = refdata.get(db).device_names
+
+    if mode == "rollup":
+        daily, hourly = analysis.device_usage_counts_rollup(db, analysis.rollup_filters(start, end, device_id))
+    else:
+        count_raw = analysis.device_usage_counts_sql if mode == "sql" else analysis.device_usage_counts_python
+        daily, hourly = analysis.device_usage_counts_with_history(
+            db, count_raw, start, end, device_id, retention.get_cutoff(db)
+        )
+
+    return analysis.summarize_device_usage(daily, hourly, device_map)
+
+# ------------------ 设备使用时长分布接口 ------------------ #
+@app.get("/analysis/usage-minutes")
+@cache.cached("usage_logs", "devices")
+def analyze_usage_minutes(
+    request: Request,
+    bucket: int = Query(60),
+    fold: str = Query("day", pattern="^(day|none)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    device_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    # 按实际使用时长（分钟）统计，跨零点、跨多天的记录拆到各自的桶；fold=day 为一天内各时段的分布，none 为时间轴
+    # 只统计原始记录：已压缩的历史只保留按小时的次数与总时长，无法拆分，history_cutoff 之前的部分不计入
+    if bucket not in analysis.USAGE_BUCKET_MINUTES:
+        raise HTTPException(status_code=422, detail=f"bucket must be one of {analysis.USAGE_BUCKET_MINUTES}")
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=422, detail="start must be before end")
+
+    device_ids, starts, finishes = analysis.usage_interval_arrays(db, start, end, device_id)
+    try:
+        devices, bucket_starts, minutes = analysis.usage_minutes_histogram(
+            device_ids, starts, finishes, bucket, fold == "day"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    result = analysis.summarize_usage_minutes(devices, bucket_starts, minutes, bucket, fold == "day",
+                                              refdata.get(db).device_names)
+    cutoff = retention.get_cutoff(db)
+    result["history_cutoff"] = cutoff.isoformat() if cutoff else None
     return result
 
 # ------------------ 设备同时使用情况分析接口 ------------------ #
-from sqlalchemy import and_
 
 @app.get("/analysis/device-cousage")
-def analyze_device_cousage(db: Session = Depends(get_db)):
-    logs = db.query(models.UsageLog).all()
-    device_map = {device.id: device.name for device in db.query(models.Device).all()}
-
-    co_usage = defaultdict(lambda: defaultdict(int))
-
-    user_logs = defaultdict(list)
-    for log in logs:
-        user_logs[log.user_id].append(log)
-
-    for logs_per_user in user_logs.values():
-        # 按开始时间排序
-        logs_per_user.sort(key=lambda x: x.start_time)
-        n = len(logs_per_user)
-
-        for i in range(n):
-            for j in range(i + 1, n):
-                log1 = logs_per_user[i]
-                log2 = logs_per_user[j]
-
-                # 判断是否时间重叠（存在交集）
-                if log1.finish_time >= log2.start_time and log2.finish_time >= log1.start_time:
-                    name1 = device_map.get(log1.device_id, f"Device {log1.device_id}")
-                    name2 = device_map.get(log2.device_id, f"Device {log2.device_id}")
-                    if name1 != name2:
-                        co_usage[name1][name2] += 1
-                        co_usage[name2][name1] += 1 
-
-    # 将 defaultdict 转为普通 dict 输出
-    result = {k: dict(v) for k, v in co_usage.items()}
-    return {"co_usage": result}
+@cache.cached("usage_logs", "devices")
+def analyze_device_cousage(request: Request, workers: int = Query(0, ge=0, le=32), db: Session = Depends(get_db)):
+    # 只取需要的列，按用户与开始时间排序后逐用户做扫描线统计
+    rows = (
+        db.query(models.UsageLog.user_id, models.UsageLog.device_id,
+                 models.UsageLog.start_time, models.UsageLog.finish_time)
+        .order_by(models.UsageLog.user_id, models.UsageLog.start_time)
+        .all()
+    )
+    device_map = refdata.get(db).device_names
+
+    user_logs = (
+        [(device_id, start, finish) for _, device_id, start, finish in group]
+        for _, group in groupby(rows, key=lambda row: row.user_id)
+    )
+    pairs = analysis.count_cousage_pairs(user_logs, workers=workers)
+    # 加上已压缩删除的历史记录参与的设备对
+    pairs.update(retention.summary_pairs(db))
+
+    return {"co_usage": analysis.build_cousage_matrix(pairs, device_map)}
 
 # ------------------ 3 ------------------ #
-def classify_correlation(corr: float) -> str:
-    """将皮尔逊系数转化为语言描述"""
-    if abs(corr) > 0.7:
-        return "强相关"
-    elif abs(corr) > 0.4:
-        return "中相关"
-    elif abs(corr) > 0.2:
-        return "弱相关"
-    else:
-        return "无明显相关"
-
 @app.get("/analysis/area-vs-usage", response_model=Dict[str, Any])
-def analyze_area_vs_usage(db: Session = Depends(get_db)):
-    user_usage = defaultdict(int)
-    user_area = {}
-
-    users = db.query(models.User).all()
-    for user in users:
-        if user.house_area:
-            user_area[user.id] = user.house_area
-
-    logs = db.query(models.UsageLog).all()
-    for log in logs:
-        user_usage[log.user_id] += 1
-
-    data = []
-    for uid in user_usage:
-        if uid in user_area:
-            data.append({
-                "user_id": uid,
-                "house_area": user_area[uid],
-                "usage_count": user_usage[uid]
-            })
-
-    if not data:
+@cache.cached("usage_logs", "users")
+def analyze_area_vs_usage(
+    request: Request,
+    bins: str = Query(",".join(f"{edge:g}" for edge in analysis.DEFAULT_AREA_BINS)),
+    include_raw: bool = True,
+    raw_offset: int = Query(0, ge=0),
+    raw_limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+):
+    # bins: 以逗号分隔的面积分组边界（升序）
+    try:
+        edges = tuple(float(edge) for edge in bins.split(","))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="bins must be comma-separated numbers")
+    if any(lo >= hi for lo, hi in zip(edges, edges[1:])):
+        raise HTTPException(status_code=422, detail="bins must be strictly increasing")
+
+    # 使用次数取自 rollup 预聚合表，一次聚合查询得到列数组
+    user_ids, areas, usages = analysis.user_area_usage_arrays(db)
+    if not len(user_ids):
         return {"message": "无足够数据进行分析"}
 
-    areas = [d["house_area"] for d in data]
-    usages = [d["usage_count"] for d in data]
-
-    # 相关性分析
-    corr, _ = pearsonr(areas, usages)
-    correlation_strength = classify_correlation(corr)
-
-    # 分区域分组分析（划分小/中/大房型）
-    area_groups = {
-        "小户型 (<=80㎡)": [],
-        "中户型 (81-120㎡)": [],
-        "大户型 (>120㎡)": []
-    }
-    for d in data:
-        if d["house_area"] <= 80:
-            area_groups["小户型 (<=80㎡)"].append(d["usage_count"])
-        elif d["house_area"] <= 120:
-            area_groups["中户型 (81-120㎡)"].append(d["usage_count"])
-        else:
-            area_groups["大户型 (>120㎡)"].append(d["usage_count"])
-
-    area_stats = {
-        label: {
-            "user_count": len(usages),
-            "avg_usage": float(np.mean(usages)) if usages else 0
-        }
-        for label, usages in area_groups.items()
-    }
-
-    # 异常用户识别
-    usage_mean = np.mean(usages)
-    usage_std = np.std(usages)
-    threshold_low = usage_mean - 1.2 * usage_std
-    threshold_high = usage_mean + 1.2 * usage_std
-
-    outliers = []
-    for d in data:
-        if d["house_area"] > 120 and d["usage_count"] < threshold_low:
-            d["outlier_reason"] = "大房低使用"
-            outliers.append(d)
-        elif d["house_area"] <= 80 and d["usage_count"] > threshold_high:
-            d["outlier_reason"] = "小房高使用"
-            outliers.append(d)
-
-    return {
-        "summary": {
-            "total_users": len(data),
-            "correlation_coefficient": round(corr, 4),
-            "correlation_strength": correlation_strength,
-            "avg_area": float(np.mean(areas)),
-            "avg_usage": float(np.mean(usages)),
-            "max_area": float(np.max(areas)),
-            "max_usage": float(np.max(usages)),
-            "min_area": float(np.min(areas)),
-            "min_usage": float(np.min(usages)),
-        },
-        "group_analysis": area_stats,
-        "outliers": outliers,
-        "raw_data": data
-    }
+    return analysis.area_vs_usage_stats(user_ids, areas, usages, edges, include_raw, raw_offset, raw_limit)
+
+# ------------------ 图表 ------------------ #
+@app.get("/charts/{chart}")
+def render_chart(
+    chart: str,
+    request: Request,
+    format: str = Query("png", pattern="^(png|svg)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    device_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    # hourly-heatmap / area-scatter / abnormal-events；数据不变时直接返回缓存的图像，ETag 为数据哈希
+    if chart not in charts.CHARTS:
+        raise HTTPException(status_code=404, detail=f"Unknown chart '{chart}'")
+    body = charts.chart_data(db, chart, start, end, device_id)
+    db.close()  # 渲染期间不占用数据库连接
+    # ETag 只取决于数据，客户端已有同一张图时不渲染
+    etag = f'"{charts.digest(chart, format, body)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    image, _ = charts.renderer.get(chart, format, body)
+    return Response(image, media_type=charts.FORMATS[format], headers=headers)
 
 # ------------------ 4.自行设计子问题 ------------------ #
+ALARM_CHECKPOINT = "auto_alarm_check"
+
 @app.get("/auto-alarm-check", response_model=list[schemas.SecurityEventWithDetails])
 def auto_alarm_check(db: Session = Depends(get_db)):
-    logs = db.query(models.UsageLog).all()
-    alerts = []
-
-    abnormal_hours = list(range(0, 5))
-    suspicious_device_types = ["door_lock", "security_camera"]
-    
-    for log in logs:
-        user = db.query(models.User).get(log.user_id)
-        device = db.query(models.Device).get(log.device_id)
-
-        reasons = []
-        if log.start_time.hour in abnormal_hours:
-            reasons.append("异常时段使用")
-        if device.type in suspicious_device_types:
-            reasons.append("可疑设备类型")
-        if (log.finish_time - log.start_time).total_seconds() > 3600:  # 使用超过1小时
-            reasons.append("长时间使用")
-        
-        if reasons:
-            message = f"⚠️ 检测到异常: {' & '.join(reasons)} - 设备: {device.name} (用户: {user.name})"
-            
-            event = models.SecurityEvent(
-                user_id=log.user_id,
-                event=message,
-                severity="warning" if len(reasons) < 2 else "critical",
-                timestamp=datetime.utcnow()
-            )
-            db.add(event)
-            db.flush() 
-            
-            alerts.append(schemas.SecurityEventWithDetails(
-                id=event.id,
-                user_id=log.user_id,
-                event=message,
-                severity=event.severity,
-                timestamp=event.timestamp,
-                user_name=user.name,
-                device_name=device.name,
-                device_type=device.type,
-                start_time=log.start_time,
-                duration_minutes=round((log.finish_time - log.start_time).total_seconds() / 60, 1),
-                reasons=reasons
-            ))
-
+    # 增量检查：从 id 高水位往回留出 ALARM_CHECK_ID_MARGIN 开始扫描，已告警的记录由反连接排除
+    # （高水位只是下界，id 较小但提交较晚的记录不会被跳过）
+    checkpoint = alerts.lock_checkpoint(db, ALARM_CHECKPOINT)
+
+    # 只查使用记录本身，用户与设备信息取自进程内的参考数据缓存
+    logs = (
+        db.query(models.UsageLog.id, models.UsageLog.user_id, models.UsageLog.device_id,
+                 models.UsageLog.start_time, models.UsageLog.finish_time)
+        .filter(models.UsageLog.id > checkpoint.last_log_id - alerts.CHECK_ID_MARGIN)
+        .filter(~exists().where(models.SecurityEvent.usage_log_id == models.UsageLog.id))  # 已告警过
+        .filter(~exists().where(models.SuppressedAlarm.usage_log_id == models.UsageLog.id))  # 告警已被删除
+        .order_by(models.UsageLog.id)
+        .all()
+    )
+    if not logs:
+        db.commit()
+        return []
+
+    ref = refdata.get(db, {log.user_id for log in logs}, {log.device_id for log in logs})
+    flagged = alerts.flag(
+        alerts.AlarmInput(log_id, user_id, start, finish, ref.user_names.get(user_id),
+                          ref.device_names.get(device_id), ref.device_types.get(device_id))
+        for log_id, user_id, device_id, start, finish in logs
+    )
+
+    # 新事件一次批量写入
+    db.add_all([event for _, event, _ in flagged])
+    checkpoint.last_log_id = max(checkpoint.last_log_id, logs[-1].id)
+    checkpoint.updated_at = datetime.utcnow()
+    alerts.prune_suppressed(db, checkpoint.last_log_id)
+    db.flush()
+
+    results = [alerts.details(log, event, reasons) for log, event, reasons in flagged]
     db.commit()
+    if flagged:
+        cache.invalidate("security_events")
+    alerts.publish(flagged)
 
     severity_order = {"critical": 0, "warning": 1}
-    alerts.sort(key=lambda x: severity_order.get(x.severity, 2))
-    return alerts
+    results.sort(key=lambda x: severity_order.get(x.severity, 2))
+    return results
+
+@app.get("/auto-alarm-check/summary")
+def auto_alarm_summary(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    device_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    # 只统计时间窗口内命中各规则的记录数，不写入事件、不推进高水位
+    rows = (
+        db.query(models.UsageLog.user_id, models.UsageLog.device_id, models.UsageLog.start_time,
+                 models.UsageLog.finish_time)
+        .filter(*analysis.usage_log_filters(start, end, device_id))
+        .all()
+    )
+    rules = alarm_rules.get_rules()
+    if not rows:
+        return rules.summarize([])
+    user_ids, device_ids, starts, finishes = zip(*rows)
+    device_types = refdata.get(db, device_ids=set(device_ids)).device_types
+    return rules.summarize(rules.evaluate(user_ids, [device_types.get(d) for d in device_ids], starts, finishes))
+
+# ------------------ 数据保留 ------------------ #
+@app.get("/retention")
+def retention_status(db: Session = Depends(get_db)):
+    return {
+        "cutoff": retention.get_cutoff(db),
+        "retention_days": retention.RETENTION_DAYS,
+        "event_retention_days": retention.EVENT_RETENTION_DAYS,
+    }
+
+@app.post("/retention/compact")
+def compact_history(
+    days: int = Query(retention.RETENTION_DAYS, ge=1),
+    event_days: int = Query(retention.EVENT_RETENTION_DAYS, ge=1),
+    db: Session = Depends(get_db),
+):
+    # 压缩早于 days 天的原始使用记录，删除早于 event_days 天的安防事件
+    try:
+        return retention.run(db, days, event_days)
+    finally:
+        cache.invalidate("usage_logs")
+
+# ------------------ 数据导出 ------------------ #
+@app.get("/export/{dataset}")
+def export_dataset(
+    dataset: str,
+    format: str = Query("arrow", pattern="^(arrow|parquet)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    chunk_days: int = Query(export.DEFAULT_CHUNK_DAYS, ge=1, le=366),
+):
+    # 数据集：usage_logs / security_events / device_usage_hourly / area_usage，按时间窗口分片流式输出
+    return export.streaming_response(dataset, format, start, end, chunk_days)
+
+# ------------------ 性能指标 ------------------ #
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Prometheus 文本格式：各接口的延迟、每请求 SQL 次数与耗时、加载行数、响应大小
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/writebehind")
+def write_behind_status():
+    # WRITE_BEHIND=flush|reserve 时单行写接口的合并写入状态
+    if writebehind.buffer is None:
+        return {"mode": "off"}
+    return writebehind.buffer.stats()
+
+# 必须在所有路由注册之后
+metrics.install(app)
 
 # uvicorn main:app --reload --port 8080
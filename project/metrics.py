@@ -0,0 +1,283 @@
+import cProfile
+import contextvars
+import functools
+import inspect
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 请求头 X-Profile: 1（cProfile）或 X-Profile: pyinstrument 时剖析该请求，需设置 PROFILING=1 才生效
+PROFILING = os.environ.get("PROFILING", "0").lower() in ("1", "true", "yes", "on")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "smart_home_profiles"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "rows", "profile", "profile_report")
+
+    def __init__(self, profile: Optional[str] = None):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.profile = profile
+        self.profile_report = None
+
+
+# 当前请求的统计；线程池中执行的同步接口会复制上下文，因此共享同一个对象
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+# ------------------ 指标存储 ------------------ #
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    """按 (method, route) 聚合的直方图与计数器，输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)  # (method, route, status) -> 次数
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.response_size = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.db_seconds = defaultdict(float)
+        self.rows = defaultdict(int)
+
+    def record(self, method: str, route: str, status: int, seconds: float, size: int, stats: RequestStats):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            self.latency[key].observe(seconds)
+            self.queries[key].observe(stats.queries)
+            self.response_size[key].observe(size)
+            self.db_seconds[key] += stats.db_seconds
+            self.rows[key] += stats.rows
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines += ["# HELP http_requests_total Requests by endpoint and status.",
+                      "# TYPE http_requests_total counter"]
+            for (method, route, status), value in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {value}')
+            for name, help_text, histograms in (
+                ("http_request_duration_seconds", "Request latency.", self.latency),
+                ("http_request_db_queries", "SQL statements executed per request.", self.queries),
+                ("http_response_size_bytes", "Response body size.", self.response_size),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (method, route), histogram in sorted(histograms.items()):
+                    lines += _histogram_lines(name, f'method="{method}",route="{route}"', histogram)
+            for name, help_text, counters in (
+                ("http_request_db_seconds_total", "Time spent in SQL statements.", self.db_seconds),
+                ("http_request_db_rows_total", "Rows fetched from result sets plus rows affected by DML without RETURNING.", self.rows),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for (method, route), value in sorted(counters.items()):
+                    lines.append(f'{name}{{method="{method}",route="{route}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+registry = Registry()
+
+
+# ------------------ SQLAlchemy 钩子 ------------------ #
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+class _CountingCursor:
+    """代理 DBAPI 游标，按实际取回的行数计数；服务端游标分批取回时同样有效"""
+
+    __slots__ = ("_cursor", "_stats")
+
+    def __init__(self, cursor, stats: RequestStats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._stats.rows += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += time.perf_counter() - conn.info["query_start"].pop()
+    if cursor.description is not None:
+        # 返回行的语句（SELECT、带 RETURNING 的 DML）：结果集随后从 context.cursor 读取
+        if context is not None:
+            context.cursor = _CountingCursor(cursor, stats)
+    elif (context is not None and (context.isinsert or context.isupdate or context.isdelete)
+          and cursor.rowcount and cursor.rowcount > 0):
+        stats.rows += cursor.rowcount
+
+
+# ------------------ 剖析 ------------------ #
+def _report_path(name: str, suffix: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.getpid()}{suffix}")
+
+
+def _profile_sync(stats: RequestStats, call, args, kwargs):
+    try:
+        from pyinstrument import Profiler
+    except ImportError:  # 未安装时退回 cProfile
+        Profiler = None
+    if stats.profile == "pyinstrument" and Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profiler.stop()
+            stats.profile_report = _report_path(call.__name__, ".html")
+            with open(stats.profile_report, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(call, *args, **kwargs)
+    finally:
+        stats.profile_report = _report_path(call.__name__, ".prof")
+        profiler.dump_stats(stats.profile_report)
+
+
+def _profiled(call):
+    """包装接口函数：只有请求要求剖析时才启用剖析器，保持同步 / 异步属性不变"""
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def async_wrapper(*args, **kwargs):
+            stats = _current.get()
+            if stats is None or stats.profile is None:
+                return await call(*args, **kwargs)
+            # 异步接口只支持 cProfile，事件循环中其他协程的开销也会计入
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                profiler.disable()
+                stats.profile_report = _report_path(call.__name__, ".prof")
+                profiler.dump_stats(stats.profile_report)
+        return async_wrapper
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        stats = _current.get()
+        if stats is None or stats.profile is None:
+            return call(*args, **kwargs)
+        return _profile_sync(stats, call, args, kwargs)
+    return wrapper
+
+
+# ------------------ 中间件 ------------------ #
+class MetricsMiddleware:
+    """纯 ASGI 中间件：流式响应结束时才记录，能统计完整的响应大小与数据库开销"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = None
+        if PROFILING:
+            for name, value in scope.get("headers", []):
+                if name == b"x-profile":
+                    profile = "pyinstrument" if value.lower() == b"pyinstrument" else "cprofile"
+        stats = RequestStats(profile)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status, size = 500, 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if stats.profile_report:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-profile-report", stats.profile_report.encode())
+                    ]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            # 未匹配的路径统一归为一类，避免标签基数失控
+            route = scope.get("route")
+            registry.record(scope["method"], getattr(route, "path", "unmatched"), status,
+                            time.perf_counter() - started, size, stats)
+
+
+def install(app):
+    """在所有路由注册完成后调用"""
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.dependant.call is not None:
+            route.dependant.call = _profiled(route.dependant.call)
+    app.add_middleware(MetricsMiddleware)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, func, literal
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -34,17 +34,40 @@ class UsageLog(Base):
     user = relationship("User", back_populates="usage_logs")
     device = relationship("Device", back_populates="usage_logs")
 
+    # 查询均按用户/设备 + 时间窗口过滤或分组
+    __table_args__ = (
+        Index("ix_usage_logs_user_start", "user_id", "start_time"),
+        Index("ix_usage_logs_device_start", "device_id", "start_time"),
+        Index("ix_usage_logs_start_time", "start_time"),
+    )
+
+
+# 区间重叠查询（某时刻 / 某时段内哪些设备在使用）用的 GiST 索引；结束时间为空视为仍在使用
+# 下界取 least()：结束早于开始的脏数据不会让 tsrange 报错
+Index(
+    "ix_usage_logs_active_range",
+    func.tsrange(func.least(UsageLog.start_time, UsageLog.finish_time), UsageLog.finish_time, "[]"),
+    postgresql_using="gist",
+).ddl_if(dialect="postgresql")
+
 
 class SecurityEvent(Base):
     __tablename__ = "security_events"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+    usage_log_id = Column(Integer, index=True)  # 触发告警的使用记录；不设外键，便于清理历史记录
     event = Column(String)
     severity = Column(String, default="info")  # 可为 info, warning, critical
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="security_events")
 
+    __table_args__ = (
+        Index("ix_security_events_user_timestamp", "user_id", "timestamp"),
+        Index("ix_security_events_timestamp", "timestamp"),
+        Index("ix_security_events_severity_timestamp", "severity", "timestamp"),
+    )
+
 
 class Feedback(Base):
     __tablename__ = "feedbacks"
@@ -54,3 +77,72 @@ class Feedback(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="feedbacks")
+
+    __table_args__ = (
+        Index("ix_feedbacks_user_timestamp", "user_id", "timestamp"),
+    )
+
+
+def feedback_search_vector(message):
+    """全文检索用的 tsvector：中日韩字符逐字拆开（靠相邻位置做短语匹配），其余按 simple 配置分词
+
+    查询必须使用同一表达式才能命中 ix_feedbacks_message_search，因此常量都内联为字面量
+    """
+    split_cjk = func.regexp_replace(
+        message, literal(r"([\u3400-\u9fff\uf900-\ufaff])", literal_execute=True),
+        literal(r"\1 ", literal_execute=True), literal("g", literal_execute=True),
+    )
+    return func.to_tsvector(literal("simple", literal_execute=True), split_cjk)
+
+
+Index(
+    "ix_feedbacks_message_search",
+    feedback_search_vector(Feedback.message),
+    postgresql_using="gin",
+).ddl_if(dialect="postgresql")
+
+
+class AlarmCheckpoint(Base):
+    __tablename__ = "alarm_checkpoints"
+    name = Column(String, primary_key=True)
+    last_log_id = Column(Integer, nullable=False, default=0)  # 已检查过的最大 usage_logs.id
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+# 告警事件被删除（如清理误报）的使用记录，/auto-alarm-check 回看时不再重新告警；
+# 只保留仍在回看范围内的记录，超出范围后由检查接口清理
+class SuppressedAlarm(Base):
+    __tablename__ = "suppressed_alarms"
+    usage_log_id = Column(Integer, primary_key=True)
+
+
+# 按 (用户, 设备, 开始整点, 结束小时) 预聚合的使用记录，由写接口增量维护
+class UsageHourlyRollup(Base):
+    __tablename__ = "usage_hourly_rollups"
+    user_id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, primary_key=True)  # start_time 截断到整点
+    end_hour = Column(Integer, primary_key=True)  # finish_time 的小时，无结束时间时为 -1
+    session_count = Column(Integer, nullable=False, default=0)
+    total_duration = Column(Float, nullable=False, default=0)  # 秒
+
+    __table_args__ = (
+        Index("ix_usage_hourly_rollups_device_hour", "device_id", "hour"),
+        Index("ix_usage_hourly_rollups_hour", "hour"),
+    )
+
+
+# 保留策略的状态：早于 cutoff 的 usage_logs 原始记录已压缩进汇总表并删除
+class RetentionState(Base):
+    __tablename__ = "retention_state"
+    name = Column(String, primary_key=True)
+    cutoff = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+# 已删除的原始记录参与的设备同时使用次数（与 /analysis/device-cousage 的设备对口径一致）
+class CoUsageSummary(Base):
+    __tablename__ = "cousage_summaries"
+    device_a = Column(Integer, primary_key=True)
+    device_b = Column(Integer, primary_key=True)
+    pair_count = Column(Integer, nullable=False, default=0)
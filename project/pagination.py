@@ -0,0 +1,81 @@
+import os
+from typing import Optional, Type
+
+from fastapi import Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+
+import serialization
+from database import SessionLocal
+
+# 流式输出时每批从服务端游标取回的行数
+STREAM_BATCH_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+# 列表接口只查询 schema 需要的列并直接编码为 JSON；FAST_READS=0 时退回 ORM 对象 + Pydantic 逐行校验
+FAST_READS = os.environ.get("FAST_READS", "1").lower() in ("1", "true", "yes", "on")
+
+
+def keyset(query, id_column, after_id: Optional[int] = None, limit: Optional[int] = None):
+    """按主键做 keyset 分页：WHERE id > after_id ORDER BY id LIMIT limit"""
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    query = query.order_by(id_column)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+class PageParams:
+    """列表接口通用的分页参数：after_id / limit / stream"""
+
+    def __init__(
+        self,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        stream: bool = False,
+    ):
+        self.after_id = after_id
+        self.limit = limit
+        self.stream = stream
+
+
+def column_select(model, schema: Type[BaseModel], after_id: Optional[int] = None, limit: Optional[int] = None):
+    """返回 (字段名, 语句)：按 schema 字段取列的 keyset 分页查询，结果为元组"""
+    return list(schema.model_fields), keyset(select(*serialization.schema_columns(model, schema)),
+                                             model.id, after_id, limit)
+
+
+def encode_ndjson(keys, rows) -> bytes:
+    return b"".join(serialization.dumps(dict(zip(keys, row))) + b"\n" for row in rows)
+
+
+def list_rows(db, model, schema: Type[BaseModel], page: PageParams):
+    """列表接口的统一实现：stream=true 时返回 NDJSON 流，否则返回一页数据"""
+    if page.stream:
+        return ndjson_stream(model, schema, page.after_id, page.limit)
+    if not FAST_READS:
+        return keyset(db.query(model), model.id, page.after_id, page.limit).all()
+    keys, stmt = column_select(model, schema, page.after_id, page.limit)
+    return serialization.FastJSONResponse(serialization.rows_to_dicts(keys, db.execute(stmt)))
+
+
+def ndjson_stream(model, schema: Type[BaseModel], after_id: Optional[int] = None,
+                  limit: Optional[int] = None) -> StreamingResponse:
+    """以 NDJSON 逐行输出，服务端分批取数，内存占用与表大小无关"""
+    def generate():
+        # 流式响应的生命周期长于请求依赖，单独持有会话
+        db = SessionLocal()
+        try:
+            if FAST_READS:
+                keys, stmt = column_select(model, schema, after_id, limit)
+                for rows in db.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE)).partitions():
+                    yield encode_ndjson(keys, rows)
+                return
+            query = keyset(db.query(model), model.id, after_id, limit)
+            for row in query.yield_per(STREAM_BATCH_SIZE):
+                yield schema.model_validate(row).model_dump_json().encode() + b"\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
@@ -0,0 +1,94 @@
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+import models
+
+# 按月 RANGE 分区的表及其分区列（仅 PostgreSQL）
+PARTITIONED_TABLES = {
+    models.UsageLog.__tablename__: "start_time",
+    models.SecurityEvent.__tablename__: "timestamp",
+}
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    years, index = divmod(month.month - 1 + n, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table)"
+    ), {"table": table}).scalar()
+
+
+def ensure_partitions(conn: Connection, table: str, start: date, end: date):
+    """创建 [start, end) 内缺失的月分区；需在数据写入默认分区之前提前创建"""
+    month = month_start(start)
+    while month < end:
+        next_month = add_months(month, 1)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month}') TO ('{next_month}')"
+        ))
+        month = next_month
+
+
+def migrate_to_partitioned(conn: Connection, table: str, months_ahead: int = 3, drop_legacy: bool = False):
+    """把普通表迁移为按月分区表：改名旧表 -> 建分区父表与月分区 -> 拷贝数据 -> 重建索引与外键"""
+    column = PARTITIONED_TABLES[table]
+    this_month = month_start(datetime.utcnow())
+
+    if is_partitioned(conn, table):
+        ensure_partitions(conn, table, this_month, add_months(this_month, months_ahead + 1))
+        return
+
+    legacy = f"{table}_legacy"
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+    conn.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey"))
+    for index in models.Base.metadata.tables[table].indexes:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+    # 分区表的唯一约束必须包含分区列，因此主键改为 (id, 分区列) 上的唯一索引
+    conn.execute(text(
+        f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        f"PARTITION BY RANGE ({column})"
+    ))
+    conn.execute(text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq OWNED BY {table}.id"))
+    conn.execute(text(f"CREATE UNIQUE INDEX {table}_id_{column}_key ON {table} (id, {column})"))
+
+    first = conn.execute(text(f"SELECT min({column}) FROM {legacy}")).scalar()
+    ensure_partitions(conn, table, month_start(first or this_month), add_months(this_month, months_ahead + 1))
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {legacy}"))
+
+    metadata_table = models.Base.metadata.tables[table]
+    for index in metadata_table.indexes:
+        index.create(conn)
+    for fk in metadata_table.foreign_keys:
+        conn.execute(text(
+            f"ALTER TABLE {table} ADD FOREIGN KEY ({fk.parent.name}) "
+            f"REFERENCES {fk.column.table.name} ({fk.column.name})"
+        ))
+
+    if drop_legacy:
+        conn.execute(text(f"DROP TABLE {legacy}"))
+
+
+def maintain(conn: Connection, months_ahead: int = 3):
+    """定期执行：为已分区的表预建未来几个月的分区"""
+    this_month = month_start(datetime.utcnow())
+    for table in PARTITIONED_TABLES:
+        if is_partitioned(conn, table):
+            ensure_partitions(conn, table, this_month, add_months(this_month, months_ahead + 1))
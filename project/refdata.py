@@ -0,0 +1,139 @@
+import os
+import select as _select
+import threading
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+import models, cache
+from database import engine
+
+# 进程内的用户 / 设备元数据缓存：本进程的 CRUD 接口立即失效；其他进程的写入靠 NOTIFY 或 TTL
+REFDATA_TTL_SECONDS = float(os.environ.get("REFDATA_TTL", "300"))
+# PostgreSQL 上设置 REFDATA_NOTIFY=1 时，各进程通过 LISTEN/NOTIFY 互相通知失效
+REFDATA_NOTIFY = (os.environ.get("REFDATA_NOTIFY", "0").lower() in ("1", "true", "yes", "on")
+                  and engine.dialect.name == "postgresql")
+NOTIFY_CHANNEL = "smart_home_refdata"
+# 查到未知 id 时重新加载的最小间隔，避免无效 id 导致每次请求都重新加载
+MISS_RELOAD_INTERVAL = 1.0
+
+
+class Snapshot(NamedTuple):
+    """某一版本的全部用户与设备，加载后不再修改，读取无需加锁"""
+    version: int
+    user_names: Dict[int, str]
+    user_areas: Dict[int, float]
+    device_names: Dict[int, str]
+    device_types: Dict[int, str]
+    devices_by_type: Dict[str, Tuple[int, ...]]
+
+    def has(self, user_ids: Iterable[int] = (), device_ids: Iterable[int] = ()) -> bool:
+        return (all(user_id in self.user_names for user_id in user_ids)
+                and all(device_id in self.device_names for device_id in device_ids))
+
+
+def load(db: Session, version: int) -> Snapshot:
+    user_names, user_areas = {}, {}
+    for user_id, name, area in db.execute(select(models.User.id, models.User.name, models.User.house_area)):
+        user_names[user_id] = name
+        user_areas[user_id] = area
+    device_names, device_types, by_type = {}, {}, {}
+    for device_id, name, device_type in db.execute(select(models.Device.id, models.Device.name, models.Device.type)):
+        device_names[device_id] = name
+        device_types[device_id] = device_type
+        by_type.setdefault(device_type, []).append(device_id)
+    return Snapshot(version, user_names, user_areas, device_names, device_types,
+                    {device_type: tuple(ids) for device_type, ids in by_type.items()})
+
+
+class RefDataCache:
+    def __init__(self, ttl: float = REFDATA_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version = 0  # 每次失效递增
+        self._snapshot: Optional[Snapshot] = None
+        self._loaded_at = 0.0
+        self._listener = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+
+    def get(self, db: Session, user_ids: Iterable[int] = (), device_ids: Iterable[int] = ()) -> Snapshot:
+        """返回当前快照；版本过期、超过 TTL 或缺少请求的 id 时从数据库重新加载"""
+        if REFDATA_NOTIFY and self._listener is None:
+            self._start_listener()
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if (snapshot is not None and snapshot.version == self._version and now - self._loaded_at <= self.ttl
+                and (snapshot.has(user_ids, device_ids) or now - self._loaded_at < MISS_RELOAD_INTERVAL)):
+            return snapshot
+        with self._lock:
+            version = self._version
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version or time.monotonic() - self._loaded_at > MISS_RELOAD_INTERVAL:
+                # 加载期间发生的失效会使版本号再次变化，下次读取时重新加载
+                snapshot = load(db, version)
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+            return snapshot
+
+    # ------------------ 跨进程失效 ------------------ #
+    def notify(self, kind: str):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :kind)"), {"channel": NOTIFY_CHANNEL, "kind": kind})
+            conn.commit()
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="refdata-listener", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        # 专用连接（psycopg2）：断线后重连，重连期间可能漏掉的通知以一次失效补偿
+        while True:
+            try:
+                raw = engine.raw_connection()
+                try:
+                    conn = raw.driver_connection
+                    conn.autocommit = True
+                    with conn.cursor() as cursor:
+                        cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    self.invalidate()
+                    while True:
+                        if _select.select([conn], [], [], 60) == ([], [], []):
+                            continue
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            self.invalidate()
+                finally:
+                    raw.invalidate()
+            except Exception:
+                time.sleep(5)
+
+
+refdata = RefDataCache()
+
+
+def _on_write(kind: str):
+    def callback():
+        refdata.invalidate()
+        if REFDATA_NOTIFY:
+            refdata.notify(kind)
+    return callback
+
+
+cache.on_invalidate("users", _on_write("users"))
+cache.on_invalidate("devices", _on_write("devices"))
+
+
+def get(db: Session, user_ids: Iterable[int] = (), device_ids: Iterable[int] = ()) -> Snapshot:
+    return refdata.get(db, user_ids, device_ids)
@@ -0,0 +1,141 @@
+import argparse
+import os
+from collections import Counter
+from datetime import datetime, time, timedelta
+from itertools import groupby
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+import models, schemas, analysis, bulk, intervals
+
+# 原始使用记录保留天数；更早的记录只保留在 usage_hourly_rollups 与 cousage_summaries 中
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", "180"))
+# 安防事件保留天数
+EVENT_RETENTION_DAYS = int(os.environ.get("EVENT_RETENTION_DAYS", "365"))
+USER_BATCH_SIZE = 200
+DELETE_BATCH_SIZE = 5000
+STATE_NAME = "usage_logs"
+
+
+def get_cutoff(db: Session) -> Optional[datetime]:
+    state = db.get(models.RetentionState, STATE_NAME)
+    return state.cutoff if state else None
+
+
+def cutoff_for(days: int, now: Optional[datetime] = None) -> datetime:
+    """截断点对齐到零点，按天 / 按小时的统计不会被拆到两边"""
+    now = now or datetime.utcnow()
+    return datetime.combine((now - timedelta(days=days)).date(), time.min)
+
+
+def summary_pairs(db: Session) -> Counter:
+    summary = models.CoUsageSummary
+    return Counter({
+        (a, b): n for a, b, n in db.execute(select(summary.device_a, summary.device_b, summary.pair_count))
+    })
+
+
+def _pairs_by_user(rows) -> Counter:
+    """rows: (user_id, device_id, start, finish)"""
+    rows = sorted(rows, key=lambda row: row[0])
+    return analysis.count_cousage_pairs(
+        [(device_id, start, finish) for _, device_id, start, finish in group]
+        for _, group in groupby(rows, key=lambda row: row[0])
+    )
+
+
+def _add_pairs(db: Session, pairs: Counter):
+    existing = {(row.device_a, row.device_b): row for row in db.scalars(select(models.CoUsageSummary))}
+    for (a, b), count in pairs.items():
+        row = existing.get((a, b))
+        if row is None:
+            db.add(models.CoUsageSummary(device_a=a, device_b=b, pair_count=count))
+        else:
+            row.pair_count += count
+
+
+def compact_usage_logs(db: Session, cutoff: datetime) -> int:
+    """删除 cutoff 之前的原始使用记录，返回删除的行数
+
+    rollup 本就包含全部记录，因此先推进截断点：分析接口对 cutoff 之前只读 rollup，
+    之后读原始记录。设备同时使用次数中涉及被删记录的部分写入 cousage_summaries，
+    每批用户的汇总与删除在同一事务中完成。
+    未开启即时告警 (INLINE_ALARMS=0) 时，应先执行 /auto-alarm-check 再压缩。
+    """
+    state = db.get(models.RetentionState, STATE_NAME, with_for_update=True)
+    if state is None:
+        state = models.RetentionState(name=STATE_NAME, cutoff=cutoff)
+        db.add(state)
+    # 截断点只前进不后退：已删除的记录无法恢复
+    state.cutoff = max(state.cutoff, cutoff)
+    state.updated_at = datetime.utcnow()
+    cutoff = state.cutoff
+    db.commit()
+
+    log = models.UsageLog
+    columns = (log.user_id, log.device_id, log.start_time, log.finish_time)
+    user_ids = db.scalars(select(log.user_id).where(log.start_time < cutoff).distinct().order_by(log.user_id)).all()
+
+    deleted = 0
+    for i in range(0, len(user_ids), USER_BATCH_SIZE):
+        batch = user_ids[i:i + USER_BATCH_SIZE]
+        old = db.execute(select(log.id, *columns).where(log.user_id.in_(batch), log.start_time < cutoff)).all()
+        old_rows = [tuple(row[1:]) for row in old]
+
+        # 与被删记录时间重叠的较新记录：设备对 = pairs(旧 ∪ 新) - pairs(新)
+        latest_finish = max((row.finish_time for row in old if row.finish_time), default=None)
+        recent_rows = []
+        if latest_finish is not None and latest_finish >= cutoff:
+            recent_rows = [tuple(row) for row in db.execute(
+                select(*columns).where(log.user_id.in_(batch), log.start_time >= cutoff,
+                                       log.start_time <= latest_finish)
+            )]
+        _add_pairs(db, _pairs_by_user(old_rows + recent_rows) - _pairs_by_user(recent_rows))
+
+        ids = [row.id for row in old]
+        intervals.stage(db, [(log_id, None) for log_id in ids])
+        for j in range(0, len(ids), DELETE_BATCH_SIZE):
+            db.execute(delete(log).where(log.id.in_(ids[j:j + DELETE_BATCH_SIZE])),
+                       execution_options={"synchronize_session": False})
+        db.commit()
+        deleted += len(ids)
+    return deleted
+
+
+def purge_security_events(db: Session, before: datetime) -> int:
+    result = bulk.delete_security_events(db, schemas.SecurityEventFilter(end=before), DELETE_BATCH_SIZE)
+    return result.affected
+
+
+def run(db: Session, days: int = RETENTION_DAYS, event_days: int = EVENT_RETENTION_DAYS) -> dict:
+    cutoff = cutoff_for(days)
+    compacted = compact_usage_logs(db, cutoff)
+    event_cutoff = cutoff_for(event_days)
+    purged = purge_security_events(db, event_cutoff)
+    return {
+        "cutoff": get_cutoff(db),
+        "compacted_logs": compacted,
+        "event_cutoff": event_cutoff,
+        "purged_events": purged,
+    }
+
+
+if __name__ == "__main__":
+    # python retention.py --days 180 --event-days 365（可放入定时任务）
+    from database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="压缩历史使用记录并清理过期安防事件")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS)
+    parser.add_argument("--event-days", type=int, default=EVENT_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine, tables=[
+        models.RetentionState.__table__, models.CoUsageSummary.__table__,
+    ])
+    db = SessionLocal()
+    try:
+        print(run(db, args.days, args.event_days))
+    finally:
+        db.close()
@@ -0,0 +1,148 @@
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.orm import Session
+
+import models
+
+# (user_id, device_id, start_time, finish_time)
+LogRow = Tuple[int, int, Optional[datetime], Optional[datetime]]
+
+NO_FINISH = -1
+UPSERT_CHUNK_SIZE = 1000
+REBUILD_BATCH_SIZE = 10000
+
+
+def log_row(log) -> LogRow:
+    return (log.user_id, log.device_id, log.start_time, log.finish_time)
+
+
+def log_row_from_dict(values: dict) -> LogRow:
+    return (values["user_id"], values["device_id"], values["start_time"], values["finish_time"])
+
+
+def aggregate(rows: Iterable[LogRow], sign: int = 1) -> dict:
+    """把使用记录折算成 rollup 增量：{(user, device, hour, end_hour): [次数, 时长]}"""
+    deltas = defaultdict(lambda: [0, 0.0])
+    for user_id, device_id, start, finish in rows:
+        if start is None:
+            continue
+        key = (
+            user_id,
+            device_id,
+            start.replace(minute=0, second=0, microsecond=0),
+            finish.hour if finish is not None else NO_FINISH,
+        )
+        delta = deltas[key]
+        delta[0] += sign
+        if finish is not None:
+            delta[1] += sign * (finish - start).total_seconds()
+    return deltas
+
+
+def _upsert(db: Session, values: list):
+    table = models.UsageHourlyRollup.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        stmt = insert(table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.device_id, table.c.hour, table.c.end_hour],
+            set_={
+                "session_count": table.c.session_count + stmt.excluded.session_count,
+                "total_duration": table.c.total_duration + stmt.excluded.total_duration,
+            },
+        )
+        db.execute(stmt)
+        return
+
+    # 不支持 ON CONFLICT 的数据库逐行合并
+    for value in values:
+        key = (value["user_id"], value["device_id"], value["hour"], value["end_hour"])
+        row = db.get(models.UsageHourlyRollup, key)
+        if row is None:
+            db.add(models.UsageHourlyRollup(**value))
+        else:
+            row.session_count += value["session_count"]
+            row.total_duration += value["total_duration"]
+    db.flush()
+
+
+def apply(db: Session, rows: Iterable[LogRow], sign: int = 1):
+    """在当前事务中把一批使用记录计入 (sign=1) 或移出 (sign=-1) rollup"""
+    values = [
+        {"user_id": u, "device_id": d, "hour": h, "end_hour": e,
+         "session_count": count, "total_duration": duration}
+        for (u, d, h, e), (count, duration) in aggregate(rows, sign).items()
+        if count or duration
+    ]
+    table = models.UsageHourlyRollup.__table__
+    key_columns = tuple_(table.c.user_id, table.c.device_id, table.c.hour, table.c.end_hour)
+    for i in range(0, len(values), UPSERT_CHUNK_SIZE):
+        chunk = values[i:i + UPSERT_CHUNK_SIZE]
+        _upsert(db, chunk)
+        if sign < 0:
+            # 移出记录后清理归零的行，保证按天统计时不出现 0 次的日期
+            keys = [(v["user_id"], v["device_id"], v["hour"], v["end_hour"]) for v in chunk]
+            db.execute(delete(table).where(key_columns.in_(keys), table.c.session_count <= 0))
+
+
+def replace(db: Session, old: LogRow, new: LogRow):
+    apply(db, [old], sign=-1)
+    apply(db, [new], sign=1)
+
+
+def prune(db: Session):
+    """删除计数归零的 rollup 行"""
+    db.execute(delete(models.UsageHourlyRollup).where(models.UsageHourlyRollup.session_count <= 0))
+
+
+def rebuild(db: Session, since: Optional[datetime] = None):
+    """从 usage_logs 重建 rollup 表；since 为保留策略的截断点，之前的原始记录已删除，只重建之后的部分"""
+    rollup, log = models.UsageHourlyRollup, models.UsageLog
+    query = select(log.user_id, log.device_id, log.start_time, log.finish_time).order_by(log.id)
+    if since is None:
+        db.execute(delete(rollup))
+    else:
+        db.execute(delete(rollup).where(rollup.hour >= since))
+        query = query.where(log.start_time >= since)
+    batch = []
+    for row in db.execute(query.execution_options(yield_per=REBUILD_BATCH_SIZE)):
+        batch.append(tuple(row))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            apply(db, batch)
+            batch.clear()
+    apply(db, batch)
+    db.commit()
+
+
+if __name__ == "__main__":
+    # python rollups.py rebuild
+    from database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="维护 usage_hourly_rollups 预聚合表")
+    parser.add_argument("command", choices=["rebuild", "prune"])
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine, tables=[
+        models.UsageHourlyRollup.__table__, models.RetentionState.__table__,
+    ])
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            import retention
+            rebuild(db, retention.get_cutoff(db))
+        else:
+            prune(db)
+            db.commit()
+    finally:
+        db.close()
@@ -42,6 +42,59 @@ class UsageLog(UsageLogBase):
     class Config:
         from_attributes = True
 
+class BulkRowError(BaseModel):
+    index: int
+    errors: list[str]
+
+class BulkIngestResult(BaseModel):
+    received: int
+    inserted: int
+    failed: int
+    errors: list[BulkRowError]
+
+class UsageLogFilter(BaseModel):
+    ids: list[int] | None = None
+    user_id: int | None = None
+    device_id: int | None = None
+    start: datetime | None = None
+    end: datetime | None = None
+
+class UsageLogPatch(BaseModel):
+    user_id: int | None = None
+    device_id: int | None = None
+    start_time: datetime | None = None
+    finish_time: datetime | None = None
+
+class UsageLogBulkUpdate(BaseModel):
+    filter: UsageLogFilter
+    values: UsageLogPatch
+
+class BulkWriteResult(BaseModel):
+    affected: int
+    chunks: int
+
+class ActiveSession(BaseModel):
+    id: int
+    user_id: int | None = None
+    device_id: int | None = None
+    start_time: datetime
+    finish_time: datetime | None = None
+
+class ActiveDevice(BaseModel):
+    user_id: int | None = None
+    user_name: str | None = None
+    device_id: int | None = None
+    device_name: str | None = None
+    device_type: str | None = None
+    sessions: int
+
+class ActiveUsage(BaseModel):
+    start: datetime
+    end: datetime
+    total_sessions: int
+    active: list[ActiveDevice]
+    sessions: list[ActiveSession]
+
 # -------- SecurityEvent -------- #
 class SecurityEventBase(BaseModel):
     user_id: int
@@ -53,9 +106,28 @@ class SecurityEventCreate(SecurityEventBase):
 
 class SecurityEvent(SecurityEventBase):
     id: int
+    usage_log_id: int | None = None
     class Config:
         from_attributes = True
 
+class SecurityEventFilter(BaseModel):
+    ids: list[int] | None = None
+    user_id: int | None = None
+    usage_log_id: int | None = None
+    severity: str | None = None
+    start: datetime | None = None
+    end: datetime | None = None
+
+class SecurityEventPatch(BaseModel):
+    user_id: int | None = None
+    event: str | None = None
+    severity: str | None = None
+    timestamp: datetime | None = None
+
+class SecurityEventBulkUpdate(BaseModel):
+    filter: SecurityEventFilter
+    values: SecurityEventPatch
+
 class SecurityEventWithDetails(SecurityEventBase):
     id: int | None = None
     severity: str
@@ -82,3 +154,10 @@ class Feedback(FeedbackBase):
     id: int
     class Config:
         from_attributes = True
+
+class FeedbackHit(Feedback):
+    rank: float
+
+class FeedbackSearchResult(BaseModel):
+    hits: list[FeedbackHit]
+    next_cursor: str | None = None
@@ -0,0 +1,389 @@
+import base64
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Numeric, and_, cast, event, func, literal, or_, select
+from sqlalchemy.orm import Session, object_session
+
+import models
+
+# auto: PostgreSQL 使用 ix_feedbacks_message_search (GIN)，其他数据库使用进程内倒排索引
+SEARCH_BACKEND = os.environ.get("FEEDBACK_SEARCH", "auto")
+INDEX_TTL_SECONDS = float(os.environ.get("FEEDBACK_INDEX_TTL", "300"))
+LOAD_BATCH_SIZE = 10000
+
+_CJK = "\u3400-\u9fff\uf900-\ufaff"
+# 与 models.feedback_search_vector 一致：中日韩字符逐字成词，其余按字母数字连续串分词
+_TOKEN = re.compile(rf"[^\W_{_CJK}]+|[{_CJK}]")
+_QUERY_PART = re.compile(r'(-?)"([^"]*)"|(-?)(\S+)')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+class Clause(NamedTuple):
+    tokens: Tuple[str, ...]  # 多个词时按相邻位置匹配（短语）
+    negated: bool
+
+
+def parse_query(q: str) -> List[Clause]:
+    """关键词之间为 AND；"双引号" 内为短语；前缀 - 表示排除。连续的中文按短语处理"""
+    clauses = []
+    for quoted_neg, phrase, word_neg, word in _QUERY_PART.findall(q):
+        tokens = tuple(tokenize(word or phrase))
+        if tokens:
+            clauses.append(Clause(tokens, bool(quoted_neg or word_neg)))
+    if not any(not clause.negated for clause in clauses):
+        raise HTTPException(status_code=422, detail="Query must contain at least one search term")
+    return clauses
+
+
+def to_tsquery_text(clauses: List[Clause]) -> str:
+    parts = []
+    for clause in clauses:
+        phrase = " <-> ".join(f"'{token}'" for token in clause.tokens)
+        parts.append(f"!({phrase})" if clause.negated else f"({phrase})")
+    return " & ".join(parts)
+
+
+# ------------------ 游标 ------------------ #
+def encode_cursor(value, row_id: int) -> str:
+    # 得分按十进制字符串保存，翻页时与排序使用的值精确比较
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif value is not None:
+        value = str(value)
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str, order: str):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if order == "rank":
+            value = Decimal(str(value))
+        elif value is not None:
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (ValueError, TypeError, InvalidOperation):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+class Hit(NamedTuple):
+    id: int
+    user_id: Optional[int]
+    message: str
+    timestamp: Optional[datetime]
+    rank: float
+
+
+# ------------------ 进程内倒排索引 ------------------ #
+class InvertedIndex:
+    """词 -> {文档序号: 出现位置}；短语按位置相邻匹配，排序使用 BM25"""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.user_ids: List[Optional[int]] = []
+        self.timestamps: List[Optional[datetime]] = []
+        self.lengths: List[int] = []
+        self.terms: List[Tuple[str, ...]] = []  # 每个文档包含的词，删除时据此清理倒排表
+        self.postings: Dict[str, Dict[int, Tuple[int, ...]]] = defaultdict(dict)
+        self.doc_of: Dict[int, int] = {}  # 记录 id -> 文档序号；删除后序号留空，整体重建时回收
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_of)
+
+    def add(self, row_id: int, user_id: Optional[int], timestamp: Optional[datetime], message: Optional[str]):
+        """按 id 覆盖：已存在的记录先删除再加入"""
+        self.remove(row_id)
+        doc = len(self.ids)
+        tokens = tokenize(message)
+        self.ids.append(row_id)
+        self.user_ids.append(user_id)
+        self.timestamps.append(timestamp)
+        self.lengths.append(len(tokens))
+        self.doc_of[row_id] = doc
+        self.total_length += len(tokens)
+        positions = defaultdict(list)
+        for position, token in enumerate(tokens):
+            positions[token].append(position)
+        for token, found in positions.items():
+            self.postings[token][doc] = tuple(found)
+        self.terms.append(tuple(positions))
+
+    def remove(self, row_id: int):
+        doc = self.doc_of.pop(row_id, None)
+        if doc is None:
+            return
+        for token in self.terms[doc]:
+            postings = self.postings[token]
+            del postings[doc]
+            if not postings:
+                del self.postings[token]
+        self.total_length -= self.lengths[doc]
+        self.ids[doc] = self.user_ids[doc] = self.timestamps[doc] = None
+        self.terms[doc] = ()
+
+    def _matches(self, tokens: Tuple[str, ...]) -> Dict[int, int]:
+        """返回 {文档序号: 出现次数}"""
+        lists = [self.postings.get(token) for token in tokens]
+        if not all(lists):
+            return {}
+        docs = set(min(lists, key=len))
+        for postings in lists:
+            docs.intersection_update(postings)
+        if len(tokens) == 1:
+            return {doc: len(lists[0][doc]) for doc in docs}
+        counts = {}
+        for doc in docs:
+            starts = set(lists[0][doc])
+            for offset, postings in enumerate(lists[1:], 1):
+                starts.intersection_update(position - offset for position in postings[doc])
+                if not starts:
+                    break
+            if starts:
+                counts[doc] = len(starts)
+        return counts
+
+    def search(self, clauses: List[Clause], user_id=None, start=None, end=None) -> Dict[int, float]:
+        """返回 {文档序号: 得分}"""
+        positive = sorted((self._matches(c.tokens) for c in clauses if not c.negated), key=len)
+        candidates = set(positive[0])
+        for matches in positive[1:]:
+            candidates.intersection_update(matches)
+        for clause in clauses:
+            if clause.negated and candidates:
+                candidates.difference_update(self._matches(clause.tokens))
+        if user_id is not None:
+            candidates = {doc for doc in candidates if self.user_ids[doc] == user_id}
+        if start is not None:
+            candidates = {doc for doc in candidates if self.timestamps[doc] is not None and self.timestamps[doc] >= start}
+        if end is not None:
+            candidates = {doc for doc in candidates if self.timestamps[doc] is not None and self.timestamps[doc] <= end}
+
+        n = len(self.doc_of)
+        average_length = self.total_length / n if n else 0
+        scores = {}
+        for doc in candidates:
+            norm = self.K1 * (1 - self.B + self.B * self.lengths[doc] / (average_length or 1))
+            score = 0.0
+            for matches in positive:
+                tf = matches[doc]
+                idf = math.log(1 + (n - len(matches) + 0.5) / (len(matches) + 0.5))
+                score += idf * tf * (self.K1 + 1) / (tf + norm)
+            scores[doc] = round(score, 6)
+        return scores
+
+
+def build_index(db: Session) -> InvertedIndex:
+    index = InvertedIndex()
+    feedback = models.Feedback
+    stmt = (
+        select(feedback.id, feedback.user_id, feedback.timestamp, feedback.message)
+        .order_by(feedback.id)
+        .execution_options(yield_per=LOAD_BATCH_SIZE)
+    )
+    for row in db.execute(stmt):
+        index.add(*row)
+    return index
+
+
+class _IndexHolder:
+    """本进程的写入在提交后逐条加入 / 移出索引；其他进程的写入由 TTL 到期后的整体重建补上"""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # 保护索引：查询与增量修改互斥
+        self._build_lock = threading.Lock()  # 同一时间只从数据库构建一次
+        self._index = None
+        self._replay = None  # 构建期间提交的变更，构建完成后重放
+        self._built_at = 0.0
+        self._stale = True
+
+    def invalidate(self):
+        self._stale = True
+
+    def apply(self, changes):
+        """应用已提交的变更；按 id 覆盖，重复应用结果不变"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(changes)
+            self._apply(changes)
+
+    def _apply(self, changes):
+        if self._index is not None:
+            for row_id, row in changes:
+                if row is None:
+                    self._index.remove(row_id)
+                else:
+                    self._index.add(row_id, *row)
+
+    @contextmanager
+    def using(self, db: Session):
+        """持有锁期间使用索引，避免查询过程中被增量修改"""
+        if self._stale or self._index is None or time.monotonic() - self._built_at > INDEX_TTL_SECONDS:
+            with self._build_lock:
+                if self._stale or self._index is None or time.monotonic() - self._built_at > INDEX_TTL_SECONDS:
+                    self._rebuild(db)
+        with self._lock:
+            yield self._index
+
+    def _rebuild(self, db: Session):
+        # 先清除标记：构建期间再次失效时，下次查询重建；构建期间照常查询旧索引
+        with self._lock:
+            self._stale = False
+            self._replay = []
+        try:
+            index = build_index(db)
+        except Exception:
+            with self._lock:
+                self._replay = None
+                self._stale = True
+            raise
+        with self._lock:
+            replay, self._replay = self._replay, None
+            self._index = index
+            self._built_at = time.monotonic()
+            self._apply(replay)
+
+
+holder = _IndexHolder()
+
+
+# ------------------ 增量维护 ------------------ #
+# 一条变更：(id, (user_id, timestamp, message))；行为 None 表示删除
+_STAGED = "feedback_index_changes"
+
+
+def stage(db: Session, changes):
+    """记录当前事务中反馈的变更，提交后更新进程内索引，回滚则丢弃"""
+    db.info.setdefault(_STAGED, []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    changes = session.info.pop(_STAGED, None)
+    if changes:
+        holder.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop(_STAGED, None)
+
+
+# 同步与异步 CRUD 接口都经过 ORM 写入
+@event.listens_for(models.Feedback, "after_insert")
+@event.listens_for(models.Feedback, "after_update")
+def _orm_saved(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        stage(session, [(target.id, (target.user_id, target.timestamp, target.message))])
+
+
+@event.listens_for(models.Feedback, "after_delete")
+def _orm_deleted(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        stage(session, [(target.id, None)])
+
+
+# ------------------ 查询 ------------------ #
+def _use_gin(db: Session) -> bool:
+    if SEARCH_BACKEND == "auto":
+        return db.get_bind().dialect.name == "postgresql"
+    return SEARCH_BACKEND == "postgresql"
+
+
+def search_feedbacks(db: Session, q: str, user_id: Optional[int] = None, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, order: str = "rank", limit: int = 20,
+                     cursor: Optional[str] = None) -> Tuple[List[Hit], Optional[str]]:
+    """返回 (一页结果, 下一页游标)；order=rank 按相关度、recent 按时间倒序，同值按 id 倒序"""
+    clauses = parse_query(q)
+    after = decode_cursor(cursor, order) if cursor else None
+    if _use_gin(db):
+        hits = _search_gin(db, clauses, user_id, start, end, order, limit + 1, after)
+    else:
+        hits = _search_memory(db, clauses, user_id, start, end, order, limit + 1, after)
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        last = hits[-1]
+        next_cursor = encode_cursor(last.rank if order == "rank" else last.timestamp, last.id)
+    return hits, next_cursor
+
+
+def gin_statement(clauses, user_id=None, start=None, end=None, order="rank", limit=20, after=None):
+    feedback = models.Feedback
+    vector = models.feedback_search_vector(feedback.message)
+    query = func.to_tsquery(literal("simple", literal_execute=True), to_tsquery_text(clauses))
+    # ts_rank 返回 real；转为 numeric 后排序、翻页比较与游标中的值完全一致
+    rank = cast(func.ts_rank(vector, query), Numeric)
+    key = rank if order == "rank" else feedback.timestamp
+
+    stmt = select(feedback.id, feedback.user_id, feedback.message, feedback.timestamp, rank).where(vector.op("@@")(query))
+    if user_id is not None:
+        stmt = stmt.where(feedback.user_id == user_id)
+    if start is not None:
+        stmt = stmt.where(feedback.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(feedback.timestamp <= end)
+    if after is not None:
+        value, row_id = after
+        if value is None:
+            # 时间为空的记录排在最后，游标已进入这一段
+            stmt = stmt.where(key.is_(None), feedback.id < row_id)
+        else:
+            page = or_(key < value, and_(key == value, feedback.id < row_id))
+            stmt = stmt.where(or_(page, key.is_(None)) if order == "recent" else page)
+    key = key.desc().nulls_last() if order == "recent" else key.desc()
+    return stmt.order_by(key, feedback.id.desc()).limit(limit)
+
+
+def _search_gin(db, clauses, user_id, start, end, order, limit, after):
+    return [Hit(*row) for row in db.execute(gin_statement(clauses, user_id, start, end, order, limit, after))]
+
+
+def _search_memory(db, clauses, user_id, start, end, order, limit, after):
+    with holder.using(db) as index:
+        scores = index.search(clauses, user_id, start, end)
+        if order == "rank":
+            def sort_key(doc):
+                return scores[doc], index.ids[doc]
+        else:
+            # 与 GIN 路径一致：时间为空的记录排在最后
+            def sort_key(doc):
+                timestamp = index.timestamps[doc]
+                return timestamp is not None, timestamp or datetime.min, index.ids[doc]
+        docs = scores.keys()
+        if after is not None:
+            value, row_id = after
+            if order == "rank":
+                after = (float(value), row_id)
+            else:
+                after = (value is not None, value or datetime.min, row_id)
+            docs = [doc for doc in docs if sort_key(doc) < after]
+        top = [(index.ids[doc], scores[doc]) for doc in heapq.nlargest(limit, docs, key=sort_key)]
+    if not top:
+        return []
+
+    # 只为这一页取出原文，之后的修改以数据库为准
+    rows = {row.id: row for row in db.execute(
+        select(models.Feedback.id, models.Feedback.user_id, models.Feedback.message, models.Feedback.timestamp)
+        .where(models.Feedback.id.in_([row_id for row_id, _ in top]))
+    )}
+    return [Hit(*rows[row_id], score) for row_id, score in top if row_id in rows]
@@ -0,0 +1,45 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Type
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+# 有 orjson 时直接在 C 中编码为 bytes，否则退回标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return jsonable_encoder(value)
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """内容已是 JSON 兼容的 dict / list，跳过 jsonable_encoder 与 Pydantic 校验"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def schema_columns(model, schema: Type[BaseModel]) -> list:
+    """按 schema 字段顺序取出模型上对应的列，只查询响应需要的列"""
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+def rows_to_dicts(keys, rows) -> list:
+    return [dict(zip(keys, row)) for row in rows]
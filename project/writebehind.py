@@ -0,0 +1,212 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select, text
+from sqlalchemy.orm import Session
+
+import models, ingest, alerts, cache
+from database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# off: 逐行提交（默认）
+# flush: 单行写接口的数据进入队列，后台线程按批提交后再响应（与逐行提交同样持久）
+# reserve: 从 PostgreSQL 序列预取 id，入队后立即响应；进程崩溃时尚未提交的数据会丢失。其他数据库按 flush 处理
+WRITE_BEHIND = os.environ.get("WRITE_BEHIND", "off")
+BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", "500"))
+# 取到第一条后最多再等待的时间，用来攒批；为 0 时只合并已在队列中的数据
+MAX_DELAY_SECONDS = float(os.environ.get("WRITE_BEHIND_MAX_DELAY_MS", "5")) / 1000
+QUEUE_SIZE = int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+# 队列满时写接口最多阻塞的时间，超时返回 503
+ENQUEUE_TIMEOUT_SECONDS = float(os.environ.get("WRITE_BEHIND_ENQUEUE_TIMEOUT", "5"))
+ACK_TIMEOUT_SECONDS = float(os.environ.get("WRITE_BEHIND_ACK_TIMEOUT", "30"))
+ID_BLOCK_SIZE = int(os.environ.get("WRITE_BEHIND_ID_BLOCK", "1000"))
+
+_STOP = object()
+
+
+class IdReserver:
+    """每张表一次从序列取一段 id；nextval 不回滚，预取后未使用的 id 只会留下空洞"""
+
+    def __init__(self, block_size: int = ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def take(self, table: str) -> int:
+        with self._lock:
+            ids = self._ids.setdefault(table, deque())
+            if not ids:
+                with engine.connect() as conn:
+                    ids.extend(conn.scalars(
+                        text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)"),
+                        {"table": table, "n": self.block_size},
+                    ))
+            return ids.popleft()
+
+
+def _reference_errors(db: Session, table: str, rows: List[dict]) -> dict:
+    """与批量导入相同的外键校验，返回 {行号: 错误信息}，只让出错的行失败"""
+    if table == "usage_logs":
+        _, errors = ingest.check_references(db, list(enumerate(rows)))
+        return {error.index: error.errors for error in errors}
+    user_ids = {row["user_id"] for row in rows}
+    known_users = set(db.scalars(select(models.User.id).where(models.User.id.in_(user_ids))))
+    return {index: [f"user_id: User {row['user_id']} not found"]
+            for index, row in enumerate(rows) if row["user_id"] not in known_users}
+
+
+class WriteBehindBuffer:
+    """有界队列 + 单个后台线程：数量或时间达到阈值即合并为一条多行 INSERT、一次提交"""
+
+    def __init__(self, mode: str = WRITE_BEHIND, batch_size: int = BATCH_SIZE,
+                 max_delay: float = MAX_DELAY_SECONDS, queue_size: int = QUEUE_SIZE):
+        if mode == "reserve" and engine.dialect.name != "postgresql":
+            logger.warning("WRITE_BEHIND=reserve needs PostgreSQL sequences; falling back to flush")
+            mode = "flush"
+        self.mode = mode
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.ids = IdReserver() if mode == "reserve" else None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+
+    def submit(self, table: str, row: dict) -> dict:
+        """在请求线程中调用：返回写入后的行（含 id）"""
+        self._ensure_started()
+        if self.ids is not None:
+            row = {**row, "id": self.ids.take(table)}
+        future = Future()
+        try:
+            self._queue.put((table, row, future), timeout=ENQUEUE_TIMEOUT_SECONDS)
+        except queue.Full:
+            raise HTTPException(status_code=503, detail="Write-behind queue is full, retry later")
+        if self.ids is not None:
+            return row
+        try:
+            return future.result(timeout=ACK_TIMEOUT_SECONDS)
+        except TimeoutError:
+            # 仍在队列中的数据之后照常写入
+            raise HTTPException(status_code=504, detail="Write not acknowledged in time")
+
+    def stop(self, timeout: float = 10):
+        """写完队列中剩余的数据后停止"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+    # ------------------ 后台线程 ------------------ #
+    def _collect(self, first) -> Tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stopping = self._collect(first)
+            by_table = {}
+            for table, row, future in batch:
+                by_table.setdefault(table, []).append((row, future))
+            for table, items in by_table.items():
+                self._flush(table, items)
+            if stopping:
+                return
+
+    def _flush(self, table: str, items: List[Tuple[dict, Future]]):
+        db = SessionLocal()
+        try:
+            try:
+                self._write(db, table, items)
+            except Exception:
+                db.rollback()
+                # 整批失败时逐行重试，只让真正出错的行失败
+                for item in items:
+                    try:
+                        self._write(db, table, [item])
+                    except Exception as e:
+                        db.rollback()
+                        self._fail(table, item, e)
+        finally:
+            db.close()
+
+    def _write(self, db: Session, table: str, items: List[Tuple[dict, Future]]):
+        rows = [row for row, _ in items]
+        errors = _reference_errors(db, table, rows)
+        accepted = [item for index, item in enumerate(items) if index not in errors]
+        flagged = []
+        if accepted:
+            new_rows = [row for row, _ in accepted]
+            if table == "usage_logs":
+                ids, flagged = ingest.insert_usage_logs(db, new_rows)
+            else:
+                ids = db.scalars(
+                    insert(models.SecurityEvent).returning(models.SecurityEvent.id, sort_by_parameter_order=True),
+                    new_rows,
+                ).all()
+            db.commit()
+            cache.invalidate(table)
+            alerts.publish(flagged)
+            for (row, future), new_id in zip(accepted, ids):
+                future.set_result({**row, "id": new_id})
+
+        self.batches += 1
+        self.written += len(accepted)
+        for index, problems in errors.items():
+            self._fail(table, items[index], HTTPException(status_code=422, detail=problems))
+
+    def _fail(self, table: str, item: Tuple[dict, Future], error: Exception):
+        row, future = item
+        self.failed += 1
+        if self.ids is not None:
+            # 已经向客户端确认，只能记录下来
+            logger.error("write-behind dropped %s row %s: %s", table, row, error)
+        future.set_exception(error)
+
+
+buffer = WriteBehindBuffer() if WRITE_BEHIND in ("flush", "reserve") else None